@@ -1,6 +1,9 @@
+from startup import StartupTimer
+
+startup_timer = StartupTimer()
+
 import os
-import io
-import random
+import queue
 
 try:
     from tkinter import *
@@ -8,145 +11,80 @@ try:
 except ImportError:
     print("Tkinter not found. Please install Tkinter.")
 
-try:
-    import pygame.mixer as mixer
-except ImportError:
-    print("Pygame not found. Please install Pygame.")
-
-try:
-    from mutagen.mp3 import MP3
-    from mutagen.id3 import ID3
-except ImportError:
-    print("Mutagen not found. Please install Mutagen.")
-
-try:
-    from PIL import ImageTk, Image
-except ImportError:
-    print("Pillow not found. Please install Pillow.")
+# pygame.mixer is imported and initialized on a background thread by the
+# player engine, Pillow and mutagen only when they are first needed
+
+from library import LibraryIndex
+from scanner import FolderScanner
+from track_store import TrackStore
+from song_list_view import VirtualSongList
+from scheduler import TickScheduler
+from art_cache import AlbumArtCache
+from thumbnail_store import ThumbnailStore
+from engine import PlayerEngine
+from search import SearchIndex
+from seek_bar import SeekBar
+from waveform import WaveformLoader
+from loudness import LoudnessAnalyzer
+from watcher import FolderWatcher
+from duplicates import DuplicateFinder
+from icons import IconCache
+from profiler import instrumentation
+
+startup_timer.mark("imports")
+
+WATCH_DRAIN_INTERVAL = 500
+# Songs added to the search index at a time between Tk events
+SEARCH_INDEX_CHUNK = 2000
 
 
 class BaseButton:
     def __init__(self, root, app, image_path, x, y, button_size=(80, 80)):
         self.app = app
         self.button = Button(root, highlightthickness=0, bd=0)
-        self.button_img = ImageTk.PhotoImage(
-            Image.open(image_path).resize(button_size, Image.LANCZOS)
-        )
-        self.button.config(image=self.button_img, command=self.action)
+        self.button_img = self.app.icons.photo(image_path, button_size)
+        self.button.config(image=self.button_img, command=self.clicked)
         self.button.place(x=x, y=y)
 
-    # Get the album art from the song
-    def get_album_art(self, song_path):
-        audio = MP3(song_path, ID3=ID3)
-        album_art = None
-        for tag in audio.tags.values():
-            if tag.FrameID.startswith("APIC"):
-                if tag.mime.startswith("image/jpeg"):
-                    album_art = tag
-                break
-        if album_art:
-            return album_art
-        else:
-            return None
+    def clicked(self):
+        with instrumentation.measure(f"button {self.__class__.__name__}"):
+            self.action()
 
     def load_image(self, image_path, button_size):
-        self.button_img = ImageTk.PhotoImage(
-            Image.open(image_path).resize(button_size, Image.LANCZOS)
-        )
+        self.button_img = self.app.icons.photo(image_path, button_size)
 
 
 class PlayButton(BaseButton):
     def action(self):
         if self.app.song_list.curselection():
-            song_info = self.app.directory_list[self.app.song_list.curselection()[0]]
-            mixer.music.load(song_info["path"] + song_info["song"])
-            mixer.music.play()
-
-            self.app.current_song_index = self.app.song_list.curselection()[0]
-            song_type = MP3(song_info["path"] + song_info["song"])
-            self.app.song_length = song_type.info.length
-            self.app.display_current_song()
-
-            album_art = self.get_album_art(song_info["path"] + song_info["song"])
-            self.app.display_album_art(album_art)
-
-            SongDuration(self.app).song_duration_time()
+            self.app.engine.play(self.app.song_list.curselection()[0])
         else:
             messagebox.showerror("Error", "Please select a song to play")
 
 
 class PauseButton(BaseButton):
     def action(self):
-        if self.app.paused == False:
-            mixer.music.pause()
-            self.change_button_image("Images/unpause.png")
-            self.app.paused = True
-        else:
-            mixer.music.unpause()
-            self.app.paused = False
-            self.change_button_image("Images/pause.png")
-            SongDuration(self.app).song_duration_time()
+        self.app.engine.toggle_pause()
 
     def change_button_image(self, new_image_path):
         self.load_image(new_image_path, button_size=(80, 80))
-        self.button.configure(image=self.button_img, command=self.action)
+        self.button.configure(image=self.button_img, command=self.clicked)
 
 
 class StopButton(BaseButton):
     def action(self):
-        mixer.music.stop()
-        self.app.song_list.select_clear(0, END)
-        self.app.paused = False
-        self.app.display_current_song_reset()
-        self.app.display_album_art(None)
-        self.app.current_song_index = 0
-        SongDuration(self.app)
-
-        if isinstance(self.app.btAutoPlay_img, AutoPlayButton):
-            self.app.btAutoPlay_img.disable_autoplay()
+        self.app.engine.stop()
 
 
 class NextButton(BaseButton):
     def action(self):
-        if self.app.current_song_index + 1 < len(self.app.directory_list):
-            next_song_index = self.app.current_song_index + 1
-            song_info = self.app.directory_list[next_song_index]
-            mixer.music.load(song_info["path"] + song_info["song"])
-            mixer.music.play()
-            self.app.current_song_index = next_song_index
-            self.app.song_list.select_clear(0, END)
-            self.app.song_list.select_set(next_song_index)
-            self.app.song_list.activate(next_song_index)
-            self.app.display_current_song()
-
-            album_art = self.get_album_art(song_info["path"] + song_info["song"])
-            self.app.display_album_art(album_art)
-
-            SongDuration(self.app).song_duration_time()
-
-        else:
+        if not self.app.engine.next():
             print("No more songs in the list")
 
 
 class PrevButton(BaseButton):
     def action(self):
-        if self.app.current_song_index > 0:
-            prev_song_index = self.app.current_song_index - 1
-            song_info = self.app.directory_list[prev_song_index]
-            mixer.music.load(song_info["path"] + song_info["song"])
-            mixer.music.play()
-            self.app.current_song_index = prev_song_index
-            self.app.song_list.select_clear(0, END)
-            self.app.song_list.select_set(prev_song_index)
-            self.app.song_list.activate(prev_song_index)
-            self.app.display_current_song()
-
-            album_art = self.get_album_art(song_info["path"] + song_info["song"])
-            self.app.display_album_art(album_art)
-
-            SongDuration(self.app).song_duration_time()
-
-        else:
+        if not self.app.engine.prev():
             print("This is the first song in the list")
 
 
@@ -157,11 +95,14 @@ class DeleteButton(BaseButton):
     def action(self):
         selected_index = self.app.song_list.curselection()
         if selected_index:
-            selected_song = self.app.directory_list.pop(selected_index[0])
-            if selected_index[0] == self.app.current_song_index:
-                StopButton.action(self)
-            self.app.song_list.delete(selected_index[0])
-            print(f"Deleted song: {selected_song}")
+            self.app.exclude_songs(
+                [self.app.track_store.path_at(position) for position in selected_index]
+            )
+            deleted_songs = self.app.engine.remove(selected_index)
+            if len(deleted_songs) == 1:
+                print(f"Deleted song: {deleted_songs[0]}")
+            else:
+                print(f"Deleted {len(deleted_songs)} songs")
         else:
             messagebox.showerror("Error", "Please select a song to delete")
 
@@ -169,94 +110,134 @@ class DeleteButton(BaseButton):
 class AutoPlayButton(BaseButton):
     def __init__(self, root, app, image_path, x, y, button_size=(80, 80)):
         super().__init__(root, app, image_path, x, y, button_size)
-        self.autoplay_enabled = False
         self.root = root
 
     def action(self):
-        if self.autoplay_enabled == False:
-            self.enable_autoplay()
-        elif self.autoplay_enabled == True:
-            self.disable_autoplay()
-
-    def enable_autoplay(self):
-        self.autoplay_enabled = True
-        self.change_button_image("Images/autoon.png")
-        print("Autoplay enabled")
-        self.play_next_song_after_delay()
-
-    def play_next_song_after_delay(self):
-        if self.autoplay_enabled:
-            self.check_music_status()
-            self.root.after(1000, self.play_next_song_after_delay)
-
-    def disable_autoplay(self):
-        self.autoplay_enabled = False
-        self.change_button_image("Images/autooff.png")
-        print("Autoplay disabled")
-
-    def check_music_status(self):
-        if not mixer.music.get_busy() and self.app.paused == False:
-            self.play_next_song()
-
-    def play_next_song(self):
-        if self.autoplay_enabled:
-            if self.app.current_song_index + 1 < len(self.app.directory_list):
-                next_song_index = self.app.current_song_index + 1
-                song_info = self.app.directory_list[next_song_index]
-                mixer.music.load(song_info["path"] + song_info["song"])
-                mixer.music.play()
-                self.app.current_song_index = next_song_index
-                self.app.song_list.select_clear(0, END)
-                self.app.song_list.select_set(next_song_index)
-                self.app.song_list.activate(next_song_index)
-                self.app.display_current_song()
-
-                album_art = self.get_album_art(song_info["path"] + song_info["song"])
-                self.app.display_album_art(album_art)
-
-                SongDuration(self.app).song_duration_time()
-            else:
-                print("No more songs in the list")
-                self.disable_autoplay()
+        self.app.engine.set_autoplay(not self.app.engine.autoplay)
+
+    # Follows the engine's autoplay state
+    def show_state(self, enabled):
+        if enabled:
+            self.change_button_image("Images/autoon.png")
+        else:
+            self.change_button_image("Images/autooff.png")
 
     def change_button_image(self, new_image_path):
         self.load_image(new_image_path, button_size=(50, 50))
-        self.button.configure(image=self.button_img, command=self.action)
+        self.button.configure(image=self.button_img, command=self.clicked)
 
 
 class ShuffleButton(BaseButton):
     def __init__(self, root, app, image_path, x, y, button_size=(80, 80)):
         super().__init__(root, app, image_path, x, y, button_size)
+        self.background = self.button.cget("bg")
 
-    # Shuffle the song in the list
+    # Turn shuffle mode on or off, the list keeps its order
     def action(self):
-        if not self.app.directory_list == []:
-            random.shuffle(self.app.directory_list)
-            self.app.song_list.delete(0, END)
-            for song_info in self.app.directory_list:
-                self.app.song_list.insert(END, song_info["song"])
-
-            self.app.current_song_index = 0
-            self.app.song_list.select_set(0)
-        else:
-            messagebox.showerror("Error no song", "No songs in the list to shuffle")
+        self.app.engine.set_shuffle(not self.app.engine.shuffle)
+
+    # The button is highlighted while shuffle is on
+    def show_state(self, enabled):
+        background = "#ffbf50" if enabled else self.background
+        self.button.config(bg=background, activebackground=background)
 
 
 class App:
     def __init__(self, root):
         self.window = root
-        mixer.init()
+        self.icons = IconCache()
+        self.track_store = TrackStore()
+        self.search_index = SearchIndex()
+        self.search_index_after_id = None
+        # Only opens the database, the index is loaded in finish_startup
+        self.library = LibraryIndex()
+        self.album_art_cache = AlbumArtCache((140, 140), ThumbnailStore(), self.icons)
+        # Playback runs in the engine, the UI follows its events
+        self.engine = PlayerEngine(
+            self.window, self.library, self.album_art_cache, self.track_store
+        )
+        self.engine.start()
+        self.waveforms = WaveformLoader(self.window, self.library)
+        self.loudness = LoudnessAnalyzer(
+            self.window, self.library, self.track_store, self.engine.loudness_measured
+        )
         self.main_window()
-        self.directory_list = []
         self.option_menu()
+        startup_timer.mark("widgets")
 
-        self.current_song_index = 0
-        self.paused = False
+        self.scanner = None
+        self.watcher = None
+        # Paths of songs taken off the list by hand
+        self.excluded = set()
+        self.duplicate_finder = None
+        self.key_hasher = None
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
 
         self.song_duration_bar = 0
-        self.song_length = 0
-
-        self.display_album_art(None)
+        self.scheduler = TickScheduler(self.window, is_idle=lambda: self.engine.paused)
+        self.song_duration = SongDuration(self)
+        self.subscribe()
+        self.display_default_album_art()
+        instrumentation.add_gauge("after() chains", self.after_chains)
+        instrumentation.add_gauge("widgets", self.widget_counts)
+        instrumentation.add_gauge(
+            "album art cache",
+            lambda: {
+                "thumbnails": len(self.album_art_cache),
+                "bytes": self.album_art_cache.used_bytes,
+            },
+        )
+        instrumentation.add_gauge(
+            "loudness analysis", lambda: {"songs left": self.loudness.pending()}
+        )
+        instrumentation.watch_lag(self.window)
+        startup_timer.mark("player state")
+
+        # The library and the audio device are set up once the window is shown
+        self.startup_steps = 2
+        self.window.after_idle(lambda: self.window.after(0, self.finish_startup))
+
+    def subscribe(self):
+        engine = self.engine
+        engine.on("audio_ready", self.audio_loaded)
+        engine.on("song_started", self.show_song)
+        engine.on("song_stopped", self.song_stopped)
+        engine.on(
+            "paused", lambda: self.btPause_img.change_button_image("Images/unpause.png")
+        )
+        engine.on("resumed", self.song_resumed)
+        engine.on("seeked", lambda seconds: self.song_duration.refresh())
+        engine.on("autoplay_changed", self.btAutoPlay_img.show_state)
+        engine.on("shuffle_changed", self.btShuffle_img.show_state)
+        engine.on(
+            "queue_changed",
+            lambda selection: self.song_list.update(self.engine.view, selection),
+        )
+        engine.on("error", lambda message: messagebox.showerror("Error", message))
+
+    def finish_startup(self):
+        startup_timer.mark("first frame")
+        self.library.load()
+        self.excluded = self.library.load_excluded()
+        startup_timer.mark("library index")
+        self.restore_playlist()
+        startup_timer.mark("playlist")
+        # Catch up with what changed in the folders while the player was closed
+        for folder in self.library.load_folders():
+            self.watch_folder(folder, reconcile=True)
+        self.loudness.update()
+        self.icons.save_atlas()
+        self.startup_step_done()
+
+    def audio_loaded(self):
+        started, ended = self.engine.audio_open_time
+        startup_timer.mark_background("audio device", started, ended)
+        self.startup_step_done()
+
+    def startup_step_done(self):
+        self.startup_steps -= 1
+        if self.startup_steps == 0:
+            startup_timer.print_report()
 
     def main_window(self):
         Label(
@@ -265,11 +246,20 @@ class App:
 
         frame = Frame(self.window)
         frame.place(x=30, y=70)
+
+        Label(self.window, text="Search", font=("Arial", 10)).place(x=30, y=42)
+        self.search_text = StringVar()
+        self.search_text.trace_add("write", lambda *args: self.apply_search())
+        self.search_entry = Entry(self.window, textvariable=self.search_text, width=30)
+        self.search_entry.bind("<Escape>", lambda event: self.search_text.set(""))
+        self.search_entry.place(x=85, y=42)
         v_scroll = Scrollbar(frame)
         v_scroll.pack(side=RIGHT, fill=Y)
 
-        self.song_list = Listbox(
+        self.song_list = VirtualSongList(
             frame,
+            self.track_store,
+            v_scroll,
             bg="#404040",
             fg="#ffbf50",
             width=120,
@@ -277,10 +267,21 @@ class App:
             font=("Arial", 8, "bold"),
             relief=SUNKEN,
             borderwidth=2,
-            yscrollcommand=v_scroll.set,
+            selectmode=EXTENDED,
         )
         self.song_list.pack(side=LEFT)
-        v_scroll.configure(command=self.song_list.yview)
+        self.song_list.bind("<Delete>", lambda event: self.btDelete_img.action())
+        self.song_list.bind("<Control-a>", lambda event: self.song_list.select_all())
+        self.song_list.bind("<Button-3>", self.show_queue_menu)
+
+        self.queue_menu = Menu(self.window, tearoff=0)
+        self.queue_menu.add_command(label="Play next", command=self.play_selected_next)
+        self.queue_menu.add_command(
+            label="Move to top", command=self.move_selected_to_top
+        )
+        self.queue_menu.add_command(
+            label="Delete", command=lambda: self.btDelete_img.action()
+        )
 
         self.volume_label = Label(
             self.window, text="Volume", font=("Arial", 12, "bold"), fg="black"
@@ -306,6 +307,10 @@ class App:
         self.btShuffle_img = ShuffleButton(
             self.window, self, "Images/shuffle.png", 720, 350, (40, 40)
         )
+        # Images the pause and autoplay buttons switch to
+        self.icons.preload(
+            [("Images/unpause.png", (80, 80)), ("Images/autoon.png", (50, 50))]
+        )
 
         self.autoplay_label = Label(
             self.window, text="Autoplay", font=("Arial", 10, "bold"), fg="black"
@@ -324,6 +329,13 @@ class App:
         ).place(x=50, y=300)
 
         self.current_song_label.place(x=250, y=450)
+        self.seek_bar = SeekBar(self.window, self.seek, bg="#141414")
+        self.seek_bar.place(x=200, y=345)
+        self.scan_progress_label = Label(self.window, text="", font=("Arial", 8))
+        self.scan_cancel_button = Button(
+            self.window, text="Cancel", font=("Arial", 8), command=self.cancel_scan
+        )
+        self.duplicate_progress_label = Label(self.window, text="", font=("Arial", 8))
         self.album_art_label = Label(self.window, bg="#141414", relief=SUNKEN)
         self.album_art_label.place(x=30, y=330, width=140, height=140)
 
@@ -335,25 +347,61 @@ class App:
         menubar.add_cascade(label="File", menu=options_menu)
         options_menu.add_command(label="Add songs", command=self.add_song)
         options_menu.add_command(label="Add folder", command=self.add_folder)
+        options_menu.add_separator()
+        self.content_duplicates = BooleanVar(value=False)
+        options_menu.add_checkbutton(
+            label="Detect duplicates by content",
+            variable=self.content_duplicates,
+            command=self.change_duplicate_mode,
+        )
+        options_menu.add_command(label="Find duplicates", command=self.find_duplicates)
+        options_menu.add_command(label="Memory usage", command=self.show_memory_usage)
+        options_menu.add_separator()
+        self.gapless = BooleanVar(value=False)
+        options_menu.add_checkbutton(
+            label="Gapless autoplay",
+            variable=self.gapless,
+            command=self.change_gapless,
+        )
+        self.normalize = BooleanVar(value=True)
+        options_menu.add_checkbutton(
+            label="Normalize loudness",
+            variable=self.normalize,
+            command=lambda: self.engine.set_normalize(self.normalize.get()),
+        )
+
+        debug_menu = Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Debug", menu=debug_menu)
+        self.instrumented = BooleanVar(value=instrumentation.enabled)
+        debug_menu.add_checkbutton(
+            label="Record timings",
+            variable=self.instrumented,
+            command=lambda: instrumentation.set_enabled(self.instrumented.get()),
+        )
+        debug_menu.add_command(
+            label="Performance report", command=self.show_performance_report
+        )
+        debug_menu.add_command(label="Start profile capture", command=self.capture)
+        self.debug_menu = debug_menu
 
     def add_song(self):
         try:
             songs = filedialog.askopenfilenames(
                 title="Select one or multiple song", filetypes=[("mp3 Files", "*.mp3")]
             )
+            self.include_songs(songs)
+            new_songs = []
             for song in songs:
                 song_name = os.path.basename(song)
-                directory_path = song.replace(song_name, "")
                 # Check if the song is already in the list
-                if not any(item["song"] == song_name for item in self.directory_list):
-                    self.directory_list.append(
-                        {"path": directory_path, "song": song_name}
-                    )
-                    self.song_list.insert(END, song_name)
+                if self.append_song(song):
+                    new_songs.append(song)
                 else:
                     messagebox.showerror("Error", f"{song_name} is already in the list")
 
             self.song_list.select_set("0")
+            self.update_library(new_songs)
+            self.songs_added()
 
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
@@ -364,58 +412,469 @@ class App:
                 title="Select a folder containing songs"
             )
             if folder_path:
-                songs = [
-                    file for file in os.listdir(folder_path) if file.endswith(".mp3")
-                ]
-                if songs:
-                    for song in songs:
-                        song_name = os.path.basename(song)
-                        # Check if the song is already in the list
-                        if not any(
-                            item["song"] == song_name for item in self.directory_list
-                        ):
-                            self.directory_list.append(
-                                {"path": folder_path + "/", "song": song_name}
-                            )
-                            self.song_list.insert(END, song_name)
-
-                    self.song_list.select_set(0)
-                else:
-                    messagebox.showinfo(
-                        "Info", "No MP3 files found in the selected folder."
+                # Scanning runs in the background, results arrive in drain_scan
+                if self.scanner is None or not self.scanner.running:
+                    self.scanner = FolderScanner(
+                        self.library, content_digests=self.content_duplicates.get()
                     )
+                    self.scan_added = 0
+                    self.scan_progress_label.place(x=500, y=35)
+                    self.scan_cancel_button.place(x=720, y=32)
+                    self.window.after(50, self.drain_scan)
+                self.scanner.scan(folder_path)
+                self.library.add_folder(folder_path)
+                self.watch_folder(folder_path)
             else:
                 messagebox.showinfo("Info", "No folder selected.")
 
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
 
-    # Attain album art from the song if available
-    def display_album_art(self, album_art):
-        if album_art is not None:
-            img_data = album_art.data
-            img = Image.open(io.BytesIO(img_data))
-            img = img.resize((150, 150), Image.LANCZOS)
-            album_art_img = ImageTk.PhotoImage(img)
-            self.album_art_label.config(image=album_art_img)
-            self.album_art_label.image = album_art_img
+    # Move songs found by the folder scanner into the song list in batches
+    def drain_scan(self):
+        scanner = self.scanner
+        if scanner is None or scanner.cancelled.is_set():
+            return
+        finished = False
+        try:
+            while True:
+                batch = scanner.results.get_nowait()
+                if batch is None:
+                    finished = True
+                    break
+                self.include_songs(batch)
+                for song in batch:
+                    if self.append_song(song):
+                        self.scan_added += 1
+        except queue.Empty:
+            pass
+
+        self.songs_added()
+        self.scan_progress_label.config(
+            text=f"Scanning: {scanner.songs_found} songs in "
+            f"{scanner.folders_scanned} folders"
+        )
+        if finished and not scanner.running:
+            self.finish_scan()
+            if scanner.songs_found == 0:
+                messagebox.showinfo(
+                    "Info", "No MP3 files found in the selected folder."
+                )
+        else:
+            self.window.after(50, self.drain_scan)
+
+    def cancel_scan(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.finish_scan()
+
+    def finish_scan(self):
+        self.scanner.shutdown()
+        self.scanner = None
+        self.scan_progress_label.place_forget()
+        self.scan_cancel_button.place_forget()
+        if len(self.track_store) > 0 and not self.song_list.curselection():
+            self.song_list.select_set(0)
+        self.save_playlist()
+
+    # Keep the song list in step with a folder on disk
+    def watch_folder(self, folder_path, reconcile=False):
+        if self.watcher is None:
+            self.watcher = FolderWatcher(
+                self.library, content_digests=self.content_duplicates.get()
+            )
+            self.window.after(WATCH_DRAIN_INTERVAL, self.drain_library_changes)
+        self.watcher.watch(folder_path, reconcile)
+
+    def drain_library_changes(self):
+        try:
+            while True:
+                self.apply_library_changes(self.watcher.changes.get_nowait())
+        except queue.Empty:
+            pass
+        self.window.after(WATCH_DRAIN_INTERVAL, self.drain_library_changes)
+
+    # Songs renamed on disk keep their place, songs deleted on disk are
+    # removed from the list and songs added on disk are added to it. Songs
+    # taken off the list by hand stay off it.
+    def apply_library_changes(self, changes):
+        track_store = self.track_store
+        renamed = False
+        for old_path, new_path in changes.moved:
+            if old_path in self.excluded:
+                self.exclude_songs([new_path])
+            track_id = track_store.find(old_path)
+            if track_id is not None and track_store.find(new_path) is None:
+                track_store.rename(track_id, new_path)
+                self.search_index.add(track_id, [track_store.name(track_id)])
+                renamed = True
+
+        added = False
+        removed = []
+        for path, exists in changes.exists.items():
+            # Written, created or deleted, what was warmed is out of date
+            self.engine.prefetcher.forget(path)
+            if exists:
+                if path not in self.excluded:
+                    added = self.append_song(path) or added
+            else:
+                track_id = track_store.find(path)
+                if track_id is not None:
+                    removed.append(track_id)
+        for folder, songs in changes.synced:
+            prefix = folder + "/"
+            for track_id in track_store.order:
+                path = track_store.path(track_id)
+                if path.startswith(prefix) and path not in songs:
+                    removed.append(track_id)
+            for song in songs:
+                if song not in self.excluded:
+                    added = self.append_song(song) or added
+
+        if removed:
+            self.engine.remove(track_store.positions_of(removed))
+        if added:
+            self.songs_added()
+        elif renamed:
+            self.song_list.refresh()
+        if renamed and (self.engine.busy() or self.engine.paused):
+            self.display_current_song()
+        if renamed or added or removed:
+            self.save_playlist()
+
+    # Songs taken off the list by hand are not added back by the folder
+    # watcher, until they are added by hand again
+    def exclude_songs(self, paths):
+        self.excluded.update(paths)
+        self.library.set_excluded(paths)
+
+    def include_songs(self, paths):
+        paths = [path for path in paths if path in self.excluded]
+        self.excluded.difference_update(paths)
+        self.library.set_excluded(paths, excluded=False)
+
+    # Add a song to the end of the list unless it is already there.
+    # The song list shows it on its next refresh.
+    def append_song(self, song):
+        return self.track_store.add(song) is not None
+
+    # Songs are the same if their full path matches, or in content mode
+    # if the files have the same bytes. The songs in the list are hashed in
+    # the background first, paths are used as keys until then.
+    def change_duplicate_mode(self):
+        content = self.content_duplicates.get()
+        if self.watcher is not None:
+            self.watcher.content_digests = content
+        if self.key_hasher is not None:
+            self.key_hasher.cancel()
+            self.key_hasher = None
+        if content:
+            self.key_hasher = DuplicateFinder(self.library)
+            self.key_hasher.start_hashing(self.track_store.paths())
+            self.window.after(200, self.check_key_hashing)
+        else:
+            self.track_store.set_key(None)
+
+    def check_key_hashing(self):
+        hasher = self.key_hasher
+        if hasher is None:
+            return
+        if not hasher.done.is_set():
+            self.window.after(200, self.check_key_hashing)
+            return
+        self.key_hasher = None
+        self.track_store.set_key(self.library.content_digest)
+
+    # Look for songs in the list that are the same file under another name
+    def find_duplicates(self):
+        if self.duplicate_finder is not None:
+            return
+        self.duplicate_finder = DuplicateFinder(self.library)
+        self.duplicate_finder.start(self.track_store.paths())
+        self.duplicate_progress_label.place(x=500, y=52)
+        self.window.after(200, self.check_duplicates)
+
+    def check_duplicates(self):
+        finder = self.duplicate_finder
+        if not finder.done.is_set():
+            self.duplicate_progress_label.config(
+                text=f"Finding duplicates, {finder.progress()}"
+            )
+            self.window.after(200, self.check_duplicates)
+            return
+        self.duplicate_finder = None
+        self.duplicate_progress_label.place_forget()
+        if finder.groups:
+            self.show_duplicate_report(finder.groups)
         else:
-            default_img_path = "Images/default.png"
-            default_img = Image.open(default_img_path)
-            default_img = default_img.resize((140, 140), Image.LANCZOS)
+            messagebox.showinfo("Duplicates", "No duplicate songs found.")
+
+    def show_duplicate_report(self, groups):
+        report = Toplevel(self.window)
+        report.title("Duplicate songs")
+        copies = sum(len(group) - 1 for group in groups)
+        wasted = sum(
+            self.library.get(group[0]).size * (len(group) - 1) for group in groups
+        )
+        Label(
+            report,
+            text=f"{len(groups)} songs have {copies} extra copies "
+            f"using {wasted / 1024 / 1024:.1f} MiB",
+            font=("Arial", 10, "bold"),
+        ).pack(anchor=W, padx=10, pady=5)
+
+        frame = Frame(report)
+        frame.pack(fill=BOTH, expand=True, padx=10)
+        scroll = Scrollbar(frame)
+        scroll.pack(side=RIGHT, fill=Y)
+        text = Text(frame, width=100, height=25, yscrollcommand=scroll.set)
+        text.pack(side=LEFT, fill=BOTH, expand=True)
+        scroll.configure(command=text.yview)
+        for group in groups:
+            size = self.library.get(group[0]).size
+            text.insert(
+                END, f"{len(group)} copies, {size / 1024 / 1024:.1f} MiB each\n"
+            )
+            for path in group:
+                text.insert(END, f"    {path}\n")
+        text.configure(state=DISABLED)
+
+        buttons = Frame(report)
+        buttons.pack(fill=X, padx=10, pady=5)
+        Button(
+            buttons,
+            text="Remove extra copies from the list",
+            command=lambda: self.remove_duplicates(groups, report),
+        ).pack(side=LEFT)
+        Button(buttons, text="Close", command=report.destroy).pack(side=RIGHT)
+
+    # Keep the copy that comes first in the list, the files stay on disk
+    def remove_duplicates(self, groups, report):
+        removed = []
+        for group in groups:
+            track_ids = [self.track_store.find(path) for path in group]
+            positions = self.track_store.positions_of(
+                [track_id for track_id in track_ids if track_id is not None]
+            )
+            removed.extend(positions[1:])
+        self.exclude_songs([self.track_store.path_at(position) for position in removed])
+        if removed:
+            self.engine.remove(removed)
+            self.save_playlist()
+        report.destroy()
+        print(f"Removed {len(removed)} duplicate songs from the list")
+
+    def show_memory_usage(self):
+        usage = self.track_store.memory_usage()
+        messagebox.showinfo(
+            "Memory usage",
+            "\n".join(f"{part}: {size / 1024:.1f} KiB" for part, size in usage.items())
+            + f"\n\n{len(self.track_store)} songs",
+        )
+
+    def show_performance_report(self):
+        report = instrumentation.report()
+        print(report)
+        messagebox.showinfo("Performance report", report)
+
+    # Start a cProfile and tracemalloc capture, or write the running one out
+    def capture(self):
+        if not instrumentation.capturing():
+            instrumentation.start_capture()
+            self.debug_menu.entryconfig(2, label="Stop profile capture")
+            return
+        self.debug_menu.entryconfig(2, label="Start profile capture")
+        try:
+            paths = instrumentation.stop_capture()
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save the capture: {e}")
+            return
+        messagebox.showinfo("Profile capture", "Saved " + ", ".join(paths))
+
+    # Pending after() chains of everything that schedules work on the window
+    def after_chains(self):
+        scheduled, scheduler_chains = self.scheduler.active_callbacks()
+        return {
+            "tick scheduler": scheduler_chains,
+            "tick callbacks": scheduled,
+            "mixer events": self.engine.mixer_events.active_callbacks(),
+            "song loader": 0 if self.engine.song_loader.after_id is None else 1,
+            "folder scan": 0 if self.scanner is None else 1,
+            # Drains the folder watcher for as long as folders are watched
+            "folder watcher": 0 if self.watcher is None else 1,
+            "waveforms": 0 if self.waveforms.after_id is None else 1,
+            "loudness": 0 if self.loudness.after_id is None else 1,
+            "search index": 0 if self.search_index_after_id is None else 1,
+            "duplicate finder": 0 if self.duplicate_finder is None else 1,
+            "content keys": 0 if self.key_hasher is None else 1,
+            "lag probe": 0 if instrumentation.lag_after_id is None else 1,
+        }
+
+    def widget_counts(self):
+        counts = {}
+        widgets = [self.window]
+        while widgets:
+            widget = widgets.pop()
+            name = widget.winfo_class()
+            counts[name] = counts.get(name, 0) + 1
+            widgets.extend(widget.winfo_children())
+        counts["total"] = sum(counts.values())
+        return counts
+
+    # Parse new songs into the library index and remember the song list
+    def update_library(self, song_paths):
+        self.library.lookup_many(song_paths)
+        self.save_playlist()
+
+    def save_playlist(self):
+        self.library.save_playlist(list(self.track_store.paths()))
+
+    # Index new songs for search in chunks between Tk events, so typing a
+    # search does not wait for the index to be built
+    def index_songs(self):
+        if self.search_index_after_id is None:
+            self.search_index_after_id = self.window.after(1, self.index_chunk)
+
+    def index_chunk(self):
+        self.search_index_after_id = None
+        if self.search_index.update(self.track_store, self.library, SEARCH_INDEX_CHUNK):
+            self.search_index.sort_tokens()
+        else:
+            self.index_songs()
+
+    # Show only the songs matching the search text. Songs not indexed in
+    # the background yet are indexed first.
+    def apply_search(self):
+        query = self.search_text.get()
+        with instrumentation.measure("search"):
+            self.search_index.update(self.track_store, self.library)
+            track_ids = self.search_index.search(query)
+            if track_ids is None:
+                view = None
+            else:
+                view = self.track_store.positions_of(track_ids)
+        self.engine.set_view(view)
+        self.song_list.set_view(view)
+
+    # New songs are in the track store and their tags in the library index
+    def songs_added(self):
+        if self.search_text.get():
+            self.apply_search()
+        else:
+            self.song_list.refresh()
+        self.loudness.update()
+        self.index_songs()
+
+    # Bring back the song list of the last session from the library index
+    def restore_playlist(self):
+        for song in self.library.load_playlist():
+            self.append_song(song)
+        if len(self.track_store) > 0:
+            self.song_list.select_set(0)
+        self.index_songs()
+
+    # Point the UI at the song that is now playing
+    def show_song(self, song_index, track):
+        self.song_list.select_clear(0, END)
+        self.song_list.select_set(song_index)
+        self.song_list.activate(song_index)
+        self.song_list.see(song_index)
+        self.display_current_song()
+
+        self.display_song_album_art(self.track_store.path_at(song_index))
+
+        self.seek_bar.show(None)
+        self.waveforms.load(track, self.show_waveform)
+        # Measure the song and the next one first if they are new
+        self.loudness.prioritize(
+            [track.path]
+            + [
+                self.track_store.path_at(position)
+                for position in self.engine.upcoming()
+            ]
+        )
+        self.song_duration.song_duration_time()
+
+    # Peaks arrive later for songs played the first time
+    def show_waveform(self, track, peaks):
+        if self.engine.busy() or self.engine.paused:
+            if self.track_store.path_at(self.engine.current_song_index) == track.path:
+                self.seek_bar.show(peaks)
+                self.song_duration.refresh()
+
+    def seek(self, fraction):
+        self.engine.seek(fraction * self.engine.song_length)
+
+    def song_stopped(self):
+        self.song_list.select_clear(0, END)
+        self.display_current_song_reset()
+        self.display_default_album_art()
+        self.song_duration.reset()
+
+    def show_queue_menu(self, event):
+        self.song_list.select_at(event.y)
+        self.queue_menu.tk_popup(event.x_root, event.y_root)
+
+    def play_selected_next(self):
+        if self.song_list.curselection():
+            self.engine.play_next(self.song_list.curselection())
+
+    def move_selected_to_top(self):
+        if self.song_list.curselection():
+            self.engine.move_to_top(self.song_list.curselection())
+
+    def song_resumed(self):
+        self.btPause_img.change_button_image("Images/pause.png")
+        self.song_duration.song_duration_time()
+
+    def change_gapless(self):
+        if not self.engine.set_gapless(self.gapless.get()):
+            messagebox.showerror("Error", "Gapless playback is unavailable")
+            self.gapless.set(False)
+
+    def close(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.duplicate_finder is not None:
+            self.duplicate_finder.cancel()
+        if self.key_hasher is not None:
+            self.key_hasher.cancel()
+        self.engine.shutdown()
+        self.waveforms.shutdown()
+        self.loudness.shutdown()
+        self.save_playlist()
+        self.library.close()
+        self.window.destroy()
+
+    # Show the album art of a song, decoded art is reused from the cache.
+    # The library entry was refreshed when the song was loaded.
+    def display_song_album_art(self, song_path):
+        track = self.library.get(song_path)
+        if track.art_digest is None:
+            self.display_default_album_art()
+        else:
+            self.show_album_art_image(
+                self.album_art_cache.art(
+                    track.art_digest, lambda: self.library.album_art_data(song_path)
+                )
+            )
+
+    # Attain album art from the song if available
+    def display_default_album_art(self):
+        self.show_album_art_image(self.album_art_cache.default())
 
-            default_album_art_img = ImageTk.PhotoImage(default_img)
-            self.album_art_label.config(image=default_album_art_img)
-            self.album_art_label.image = default_album_art_img
+    def show_album_art_image(self, album_art_img):
+        self.album_art_label.config(image=album_art_img)
+        self.album_art_label.image = album_art_img
 
     def volume(self, val):
-        volume = int(val) / 100
-        mixer.music.set_volume(volume)
+        self.engine.set_volume(int(val) / 100)
 
     def display_current_song(self):
-        if self.directory_list:
-            current_song_info = self.directory_list[self.current_song_index]
-            current_song_name = current_song_info["song"]
+        if len(self.track_store) > 0:
+            current_song_name = self.track_store.name_at(self.engine.current_song_index)
             self.current_song_label.config(
                 text=f"Currently Playing: {current_song_name}"
             )
@@ -438,22 +897,40 @@ class SongDuration:
         )
         self.song_duration_bar.place(x=250, y=400)
 
+        self.track_id = None
+        self.song_length = 0
+
     def update_song_duration_label(self, current_time):
-        song_info = self.app.directory_list[self.app.current_song_index]
-        song_type = MP3(song_info["path"] + song_info["song"])
-        song_length = song_type.info.length
+        # The length is only looked up again when the song changed
+        track_id = self.app.track_store.track_id(self.app.engine.current_song_index)
+        if track_id != self.track_id:
+            self.track_id = track_id
+            song_path = self.app.track_store.path(track_id)
+            self.song_length = self.app.library.get(song_path).duration
         self.song_duration_bar.config(
-            text=f"Time is: {self.format_time(current_time)} of {self.format_time(song_length)}"
+            text=f"Time is: {self.format_time(current_time)} of {self.format_time(self.song_length)}"
         )
-        self.app.window.after(100, self.song_duration_time)
+        self.app.seek_bar.show_position(current_time, self.song_length)
 
+    # Start updating the label, the app's scheduler runs a single timer for it
     def song_duration_time(self):
+        self.app.scheduler.add(self.refresh)
+
+    def refresh(self):
         try:
-            if mixer.music.get_busy() or self.app.paused:
-                current_time = mixer.music.get_pos() / 1000
-                self.update_song_duration_label(current_time)
+            engine = self.app.engine
+            if engine.busy() or engine.paused:
+                self.update_song_duration_label(engine.position())
+            else:
+                self.app.scheduler.remove(self.refresh)
         except Exception as e:
             print("Error in song duration:", str(e))
+            self.app.scheduler.remove(self.refresh)
+
+    def reset(self):
+        self.app.scheduler.remove(self.refresh)
+        self.song_duration_bar.config(text="Song Duration")
+        self.app.seek_bar.show(None)
 
     def format_time(self, time_in_seconds):
         minutes, seconds = divmod(int(time_in_seconds), 60)
@@ -467,11 +944,10 @@ if __name__ == "__main__":
     window.geometry("800x500")
     window.resizable(0, 0)
 
-    ico = Image.open("Images/icon.png")
-    photo = ImageTk.PhotoImage(ico)
+    photo = PhotoImage(file="Images/icon.png")
     window.wm_iconphoto(False, photo)
+    startup_timer.mark("tk window")
 
     app = App(window)
-    song_duration = SongDuration(app)
 
     window.mainloop()
@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+
+from profiler import instrumentation
+
+ALBUM_ART_CACHE_BYTES = 16 * 1024 * 1024
+PREFETCHED_ART_LIMIT = 8
+DEFAULT_ALBUM_ART = "Images/default.png"
+
+
+# Keeps album art thumbnails ready to display, keyed by the hash of the
+# embedded image so songs sharing a cover share one thumbnail. The least
+# recently shown thumbnails are dropped once the decoded images use more
+# than `max_bytes`. Thumbnails missing here come from the on-disk store.
+class AlbumArtCache:
+    def __init__(self, size, store, icons, max_bytes=ALBUM_ART_CACHE_BYTES):
+        self.size = size
+        self.store = store
+        self.icons = icons
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.used_bytes = 0
+        self.default_image = None
+        # Thumbnails decoded by the prefetcher, waiting to become photo images
+        self.prefetched = OrderedDict()
+        self.prefetched_lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.images or key in self.prefetched
+
+    def __len__(self):
+        return len(self.images)
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if key in self.images:
+            self.used_bytes -= self.image_bytes(self.images.pop(key))
+        self.images[key] = image
+        self.used_bytes += self.image_bytes(image)
+        while self.used_bytes > self.max_bytes and len(self.images) > 1:
+            _, oldest = self.images.popitem(last=False)
+            self.used_bytes -= self.image_bytes(oldest)
+        return image
+
+    # Photo images are stored by Tk as 32 bit pixels
+    def image_bytes(self, image):
+        return image.width() * image.height() * 4
+
+    # The thumbnail of the art with this digest. `load_data` returns the
+    # embedded image bytes and is only called if no thumbnail exists yet.
+    def art(self, digest, load_data):
+        image = self.get(digest)
+        if image is None:
+            with self.prefetched_lock:
+                img = self.prefetched.pop(digest, None)
+            if img is None:
+                img = self.store.thumbnail(digest, self.size, load_data)
+            if img is None:
+                return self.default()
+            from PIL import ImageTk
+
+            with instrumentation.measure("art photo image"):
+                image = self.put(digest, ImageTk.PhotoImage(img))
+        return image
+
+    # Called from worker threads. Photo images can only be made on the Tk
+    # thread, so the decoded PIL image is kept until art() needs it.
+    def prefetch(self, digest, load_data):
+        if digest in self:
+            return
+        img = self.store.thumbnail(digest, self.size, load_data)
+        if img is not None:
+            self.add_prefetched(digest, img)
+
+    def add_prefetched(self, digest, img):
+        with self.prefetched_lock:
+            self.prefetched[digest] = img
+            while len(self.prefetched) > PREFETCHED_ART_LIMIT:
+                self.prefetched.popitem(last=False)
+
+    # The art shown for songs without any, rendered only once
+    def default(self):
+        if self.default_image is None:
+            self.default_image = self.icons.photo(DEFAULT_ALBUM_ART, self.size)
+        return self.default_image
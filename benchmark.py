@@ -0,0 +1,352 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import struct
+import argparse
+import platform
+
+from engine import PlayerEngine, EventLoop
+from library import LibraryIndex
+from scanner import FolderScanner
+from scheduler import TickScheduler
+from thumbnail_store import ThumbnailStore
+
+FIXTURE_DIR = "bench_fixtures"
+BENCHMARK_SIZES = (1000, 10000, 100000)
+SONGS_PER_FOLDER = 1000
+SONGS_PER_ALBUM = 10
+FIXTURE_SECONDS = 0.5
+ART_SIZE = (150, 150)
+# One MPEG-1 Layer III frame, 128 kbit/s at 44.1 kHz, 26 ms of silence
+MPEG_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+FRAME_SECONDS = 1152 / 44100
+
+
+# Benchmarks the player without a display: the engine runs on the SDL dummy
+# audio driver and its timers on an EventLoop. Fixtures are synthetic MP3s
+# written once per size into bench_fixtures/ and reused by later runs.
+#
+#   python benchmark.py --sizes 1000 10000 --soak 60 --output results.json
+
+
+def id3_frame(frame_id, data):
+    return frame_id.encode() + struct.pack(">I", len(data)) + b"\0\0" + data
+
+
+def id3_text_frame(frame_id, text):
+    return id3_frame(frame_id, b"\x03" + text.encode("utf-8"))
+
+
+# A syncsafe ID3v2.3 header followed by the frames
+def id3_tag(frames):
+    body = b"".join(frames)
+    size = len(body)
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x03\x00\x00" + syncsafe + body
+
+
+def cover_image(album):
+    from PIL import Image
+
+    rng = random.Random(album)
+    color = tuple(rng.randrange(256) for _ in range(3))
+    img = Image.new("RGB", (300, 300), color)
+    img.paste((255 - color[0], 255 - color[1], 255 - color[2]), (50, 50, 250, 250))
+    data = io.BytesIO()
+    img.save(data, "PNG")
+    return data.getvalue()
+
+
+# Write `count` songs in folders of SONGS_PER_FOLDER, every album of
+# SONGS_PER_ALBUM songs shares one embedded cover when `with_art` is set
+def make_fixtures(count, with_art, directory=FIXTURE_DIR, seconds=FIXTURE_SECONDS):
+    root = os.path.join(directory, f"{count}_{'art' if with_art else 'noart'}")
+    marker = os.path.join(root, "complete")
+    if os.path.exists(marker):
+        return root
+
+    audio = MPEG_FRAME * max(1, round(seconds / FRAME_SECONDS))
+    cover = None
+    for song in range(count):
+        folder = os.path.join(root, f"folder{song // SONGS_PER_FOLDER:04d}")
+        if song % SONGS_PER_FOLDER == 0:
+            os.makedirs(folder, exist_ok=True)
+        album = song // SONGS_PER_ALBUM
+        frames = [
+            id3_text_frame("TIT2", f"Song {song}"),
+            id3_text_frame("TPE1", f"Artist {album % 97}"),
+            id3_text_frame("TALB", f"Album {album}"),
+        ]
+        if with_art:
+            if song % SONGS_PER_ALBUM == 0:
+                cover = cover_image(album)
+            frames.append(id3_frame("APIC", b"\x00image/png\x00\x03\x00" + cover))
+        with open(os.path.join(folder, f"song{song:06d}.mp3"), "wb") as f:
+            f.write(id3_tag(frames))
+            f.write(audio)
+
+    with open(marker, "w") as f:
+        f.write(str(count))
+    return root
+
+
+def resident_memory():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def summary(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "median_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+# Runs every benchmark of one fixture set on a fresh library and engine
+class PlayerBenchmark:
+    def __init__(self, fixture_root, repeats=20):
+        self.fixture_root = fixture_root
+        self.repeats = repeats
+        self.db_path = os.path.join(fixture_root, "library.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+        self.loop = EventLoop()
+        self.library = LibraryIndex(self.db_path)
+        self.engine = PlayerEngine(self.loop, self.library, headless=True)
+        self.track_store = self.engine.track_store
+        self.started = []
+        self.engine.on("song_started", lambda index, track: self.started.append(index))
+
+    def run(self, soak_seconds):
+        self.engine.start()
+        if not self.loop.run(timeout=10, until=self.engine.audio_ready.is_set):
+            raise RuntimeError("Could not open the audio device")
+        self.loop.run(timeout=0.1)
+        results = {
+            "import": self.bench_import(),
+            "rescan": self.bench_import(rescan=True),
+            "shuffle": self.bench_shuffle(),
+            "next_prev": self.bench_next_prev(),
+            "art_display": self.bench_art_display(),
+            "delete": self.bench_delete(),
+            "soak": self.bench_soak(soak_seconds),
+        }
+        self.engine.shutdown()
+        self.library.close()
+        return results
+
+    # Same work as App.add_folder and App.drain_scan, without the widgets
+    def bench_import(self, rescan=False):
+        self.track_store.clear()
+        started = time.perf_counter()
+        scanner = FolderScanner(self.library)
+        scanner.scan(self.fixture_root)
+        while True:
+            batch = scanner.results.get()
+            if batch is None:
+                break
+            for song in batch:
+                self.track_store.add(song)
+        scanner.shutdown()
+        elapsed = time.perf_counter() - started
+        return {
+            "songs": len(self.track_store),
+            "seconds": elapsed,
+            "songs_per_second": len(self.track_store) / elapsed if elapsed else None,
+            "cached": rescan,
+        }
+
+    # Turning shuffle on and drawing the songs that play next
+    def bench_shuffle(self):
+        toggles = []
+        draws = []
+        for _ in range(self.repeats):
+            started = time.perf_counter()
+            self.engine.set_shuffle(True)
+            toggles.append(time.perf_counter() - started)
+            for ahead in range(1, self.repeats + 1):
+                started = time.perf_counter()
+                self.engine.shuffle_order.upcoming(ahead)
+                draws.append(time.perf_counter() - started)
+            self.engine.set_shuffle(False)
+        return {"toggle": summary(toggles), "draw": summary(draws)}
+
+    # Time from pressing next or prev until the song plays
+    def play_and_wait(self, action):
+        count = len(self.started)
+        started = time.perf_counter()
+        if not action():
+            return None
+        self.loop.run(timeout=10, until=lambda: len(self.started) > count)
+        return time.perf_counter() - started
+
+    def bench_next_prev(self):
+        self.started.clear()
+        self.engine.play(0)
+        self.loop.run(timeout=10, until=lambda: self.started)
+        next_samples = []
+        prev_samples = []
+        for _ in range(self.repeats):
+            next_samples.append(self.play_and_wait(self.engine.next))
+        for _ in range(self.repeats):
+            prev_samples.append(self.play_and_wait(self.engine.prev))
+        self.engine.stop()
+        return {
+            "next": summary([s for s in next_samples if s is not None]),
+            "prev": summary([s for s in prev_samples if s is not None]),
+        }
+
+    # Tk images need a display, so this covers what happens before them:
+    # reading the embedded art and decoding, resizing and caching it
+    def bench_art_display(self):
+        songs = [
+            self.track_store.path_at(position)
+            for position in range(min(self.repeats, len(self.track_store)))
+        ]
+        store = ThumbnailStore(os.path.join(self.fixture_root, "thumbnails"))
+        results = {}
+        for phase in ("cold", "warm"):
+            samples = []
+            for song in songs:
+                started = time.perf_counter()
+                track = self.library.get(song)
+                if track.art_digest is not None:
+                    store.thumbnail(
+                        track.art_digest,
+                        ART_SIZE,
+                        lambda: self.library.album_art_data(song),
+                    )
+                samples.append(time.perf_counter() - started)
+            results[phase] = summary(samples)
+        return results
+
+    def bench_delete(self):
+        samples = []
+        rng = random.Random(0)
+        for _ in range(self.repeats):
+            position = rng.randrange(len(self.track_store))
+            started = time.perf_counter()
+            self.engine.remove([position])
+            samples.append(time.perf_counter() - started)
+        # Every tenth song in one go
+        positions = range(0, len(self.track_store), 10)
+        started = time.perf_counter()
+        self.engine.remove(positions)
+        return {
+            "single": summary(samples),
+            "bulk": {"songs": len(positions), "seconds": time.perf_counter() - started},
+        }
+
+    # Autoplay through the songs for `seconds` with the duration label's
+    # refresh running, then scale the CPU time up to an hour of playback
+    def bench_soak(self, seconds):
+        scheduler = TickScheduler(self.loop, is_idle=lambda: self.engine.paused)
+        labels = []
+
+        # What SongDuration.refresh does, minus the Label
+        def refresh():
+            if self.engine.busy() or self.engine.paused:
+                minutes, seconds = divmod(int(self.engine.position()), 60)
+                labels.append(f"Time is: {minutes:02d}:{seconds:02d}")
+
+        def song_started(index, track):
+            scheduler.add(refresh)
+
+        self.engine.on("song_started", song_started)
+        rss = [resident_memory()]
+        songs_before = len(self.started)
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        self.engine.play(0)
+        self.engine.set_autoplay(True)
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            self.loop.run(timeout=min(1, deadline - time.perf_counter()))
+            rss.append(resident_memory())
+            if not self.engine.autoplay:
+                # Went past the last song, start over
+                self.engine.play(0)
+                self.engine.set_autoplay(True)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        self.engine.stop()
+        scheduler.stop()
+        return {
+            "seconds": elapsed,
+            "cpu_seconds": cpu,
+            "cpu_percent": cpu / elapsed * 100,
+            "cpu_seconds_per_hour": cpu / elapsed * 3600,
+            # The hour is scaled up from a run this long
+            "extrapolated_from_seconds": elapsed,
+            "songs_played": len(self.started) - songs_before,
+            "duration_refreshes": len(labels),
+            "rss_start": rss[0],
+            "rss_end": rss[-1],
+            "rss_max": max(rss),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the music player")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BENCHMARK_SIZES)
+    parser.add_argument("--art", choices=("with", "without", "both"), default="both")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument(
+        "--soak", type=float, default=60, help="seconds of playback to measure"
+    )
+    parser.add_argument("--fixtures", default=FIXTURE_DIR)
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args()
+
+    art_modes = {"with": [True], "without": [False], "both": [False, True]}
+    runs = []
+    for size in args.sizes:
+        for with_art in art_modes[args.art]:
+            print(f"{size} songs, {'with' if with_art else 'without'} art")
+            started = time.perf_counter()
+            fixture_root = make_fixtures(size, with_art, args.fixtures)
+            fixture_seconds = time.perf_counter() - started
+            results = PlayerBenchmark(fixture_root, args.repeats).run(args.soak)
+            runs.append(
+                {
+                    "songs": size,
+                    "album_art": with_art,
+                    "fixture_seconds": fixture_seconds,
+                    "results": results,
+                }
+            )
+
+    import pygame
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "runs": runs,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
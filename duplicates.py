@@ -0,0 +1,171 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DUPLICATE_WORKERS = 16
+SAMPLE_BYTES = 64 * 1024
+CHUNK_BYTES = 1024 * 1024
+
+
+# Hash of the start, the middle and the end of a file, files up to three
+# samples long are hashed whole
+def partial_hash(path, size):
+    sha1 = hashlib.sha1(b"%d:" % size)
+    with open(path, "rb") as f:
+        if size <= 3 * SAMPLE_BYTES:
+            sha1.update(f.read())
+        else:
+            for offset in (0, (size - SAMPLE_BYTES) // 2, size - SAMPLE_BYTES):
+                f.seek(offset)
+                sha1.update(f.read(SAMPLE_BYTES))
+    return sha1.hexdigest()
+
+
+def full_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+# Finds songs with the same bytes under different names. Only files of the
+# same size can be the same, and sizes come from the library index without
+# touching the disk. Of those, a few samples of each file are hashed, and
+# only files whose samples match are read whole. Files are hashed on a pool
+# of worker threads, so on network shares many reads are in flight at once,
+# and the hashes are kept in the library index for the next run.
+class DuplicateFinder:
+    def __init__(self, library, workers=DUPLICATE_WORKERS):
+        self.library = library
+        self.workers = workers
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.stage = "comparing sizes"
+        self.files_hashed = 0
+        self.files_to_hash = 0
+        # Lists of paths with the same content, set once done
+        self.groups = None
+
+    # Look for duplicates among `paths` on a background thread
+    def start(self, paths):
+        threading.Thread(target=self.run, args=(list(paths),), daemon=True).start()
+
+    # Only hash every one of `paths` whole on a background thread, so their
+    # content keys are in the library index once done
+    def start_hashing(self, paths):
+        threading.Thread(
+            target=self.run_hashing, args=(list(paths),), daemon=True
+        ).start()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self, paths):
+        try:
+            self.groups = self.find(paths)
+        except Exception as e:
+            print("Could not look for duplicates:", str(e))
+            self.groups = []
+        finally:
+            self.done.set()
+
+    def run_hashing(self, paths):
+        try:
+            self.stage = "hashing whole files"
+            tracks = [self.library.get(path) for path in paths]
+            self.hash_all([track for track in tracks if track.size], 1)
+        except Exception as e:
+            print("Could not hash songs:", str(e))
+        finally:
+            self.done.set()
+
+    def find(self, paths):
+        by_size = {}
+        for path in paths:
+            track = self.library.get(path)
+            if track.size:
+                by_size.setdefault(track.size, []).append(track)
+        candidates = [
+            track for tracks in by_size.values() if len(tracks) > 1 for track in tracks
+        ]
+
+        self.stage = "hashing samples"
+        partial_hashes = self.hash_all(candidates, 0)
+        by_partial = self.group(candidates, partial_hashes)
+
+        # Small files were hashed whole already
+        candidates = [
+            track
+            for tracks in by_partial
+            if tracks[0].size > 3 * SAMPLE_BYTES
+            for track in tracks
+        ]
+        self.stage = "hashing whole files"
+        full_hashes = self.hash_all(candidates, 1)
+
+        groups = []
+        for tracks in by_partial:
+            if tracks[0].size > 3 * SAMPLE_BYTES:
+                groups.extend(self.group(tracks, full_hashes))
+            else:
+                groups.append(tracks)
+        # The copies wasting the most space first
+        groups.sort(key=lambda tracks: tracks[0].size * (len(tracks) - 1), reverse=True)
+        return [[track.path for track in tracks] for tracks in groups]
+
+    # Groups of two or more tracks with the same hash
+    def group(self, tracks, hashes):
+        groups = {}
+        for track in tracks:
+            digest = hashes.get(track.path)
+            if digest is not None:
+                groups.setdefault(digest, []).append(track)
+        return [tracks for tracks in groups.values() if len(tracks) > 1]
+
+    # Hash the tracks on the pool, `which` is 0 for the partial hash and 1
+    # for the full hash. Returns path -> hash, failed files are left out.
+    def hash_all(self, tracks, which):
+        hashes = {}
+        computed = []
+        for track in tracks:
+            cached = self.library.cached_hashes(track)
+            if cached[which] is not None:
+                hashes[track.path] = cached[which]
+        missing = [track for track in tracks if track.path not in hashes]
+        with self.lock:
+            self.files_hashed = len(tracks) - len(missing)
+            self.files_to_hash = len(tracks)
+
+        def hash_one(track):
+            digest = None
+            if not self.cancelled.is_set():
+                try:
+                    if which == 0:
+                        digest = partial_hash(track.path, track.size)
+                    else:
+                        digest = full_hash(track.path)
+                except OSError as e:
+                    print(f"Could not hash {track.path}: {e}")
+            with self.lock:
+                self.files_hashed += 1
+            return digest
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for track, digest in zip(missing, pool.map(hash_one, missing)):
+                if digest is not None:
+                    hashes[track.path] = digest
+                    computed.append((track, digest))
+
+        rows = []
+        for track, digest in computed:
+            cached = list(self.library.cached_hashes(track))
+            cached[which] = digest
+            rows.append((track, cached[0], cached[1]))
+        self.library.save_hashes(rows)
+        return hashes
+
+    def progress(self):
+        with self.lock:
+            return f"{self.stage}: {self.files_hashed} of {self.files_to_hash} files"
@@ -0,0 +1,526 @@
+import os
+import heapq
+from bisect import bisect_left, bisect_right
+import threading
+import time
+
+from track_store import TrackStore
+from prefetch import Prefetcher, PREFETCH_COUNT
+from mixer_events import MixerEventDispatcher
+from loader import SongLoader
+from profiler import instrumentation
+from shuffle import ShuffleOrder
+from loudness import loudness_gain
+
+AUDIO_POLL_INTERVAL = 20
+
+
+# Stands in for the Tk window when there is no display. The engine and its
+# helpers only need after() and after_cancel(), this runs those callbacks
+# on the thread that calls run().
+class EventLoop:
+    def __init__(self):
+        self.timers = []
+        self.pending = set()
+        self.next_id = 0
+
+    def after(self, delay, callback, *args):
+        self.next_id += 1
+        due = time.monotonic() + delay / 1000
+        heapq.heappush(self.timers, (due, self.next_id, callback, args))
+        self.pending.add(self.next_id)
+        return self.next_id
+
+    def after_idle(self, callback, *args):
+        return self.after(0, callback, *args)
+
+    def after_cancel(self, after_id):
+        self.pending.discard(after_id)
+
+    # There is no window that could be minimized
+    def state(self):
+        return "normal"
+
+    # Run callbacks until `until()` returns true, `timeout` seconds passed or
+    # nothing is scheduled any more. Returns the last result of `until()`.
+    def run(self, timeout=None, until=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if until is not None and until():
+                return True
+            while self.timers and self.timers[0][1] not in self.pending:
+                heapq.heappop(self.timers)
+            if not self.timers:
+                return False
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return False
+            due, after_id, callback, args = self.timers[0]
+            if due > now:
+                time.sleep(due - now if deadline is None else min(due, deadline) - now)
+                continue
+            heapq.heappop(self.timers)
+            self.pending.discard(after_id)
+            callback(*args)
+
+
+# Plays the songs of a TrackStore without knowing about any UI. The engine
+# owns the queue, the current position, the pause state and pygame's mixer,
+# and tells its subscribers what happened through events:
+#
+#   audio_ready()               the audio device is open
+#   song_started(index, track)  a song started, also after a gapless switch
+#   song_stopped()
+#   paused(), resumed()
+#   seeked(seconds)
+#   autoplay_changed(enabled)
+#   shuffle_changed(enabled)
+#   queue_changed(selection)    songs were removed or moved, `selection`
+#                               are the new positions of the moved songs
+#   error(message)
+#
+# `root` is the Tk window, or an EventLoop when there is no display. With
+# headless=True SDL uses its dummy drivers, so no sound card is needed.
+class PlayerEngine:
+    def __init__(
+        self, root, library, album_art_cache=None, track_store=None, headless=False
+    ):
+        self.root = root
+        self.library = library
+        self.track_store = TrackStore() if track_store is None else track_store
+        if headless:
+            os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+        self.handlers = {}
+        self.mixer = None
+        self.audio_ready = threading.Event()
+        # Set once opening the audio device is over, whether it worked or not
+        self.audio_opened = threading.Event()
+        # Why the audio device could not be opened
+        self.audio_error = None
+        # perf_counter() values of when opening the audio device started and ended
+        self.audio_open_time = None
+
+        self.current_song_index = 0
+        self.paused = False
+        self.autoplay = False
+        self.gapless = False
+        # Position of the song handed to mixer.music.queue for gapless playback
+        self.queued_index = None
+        # Sorted positions next and prev step through, None for every song
+        self.view = None
+        self.shuffle = False
+        self.shuffle_order = ShuffleOrder(self.track_store)
+        self.song_length = 0
+        # get_pos() counts from where the song started and ignores seeks,
+        # this is added to it to get the position in the song
+        self.seek_offset = 0
+        self.volume = 0.5
+        # Scales the volume to even out the loudness of songs
+        self.normalize = True
+        self.gain = 1.0
+        # When the song that is loading now was asked for
+        self.play_requested = None
+
+        self.mixer_events = MixerEventDispatcher(root, self.time_left)
+        self.mixer_events.connect(self.song_ended)
+        self.prefetcher = Prefetcher(library, album_art_cache)
+        self.song_loader = SongLoader(
+            root, library, album_art_cache, self.audio_ready, self.audio_opened
+        )
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def emit(self, event, *args):
+        for handler in list(self.handlers.get(event, ())):
+            handler(*args)
+
+    # Open the audio device on a background thread, audio_ready is emitted
+    # on the UI thread once it is open
+    def start(self):
+        threading.Thread(target=self.open_audio, daemon=True).start()
+        self.root.after(AUDIO_POLL_INTERVAL, self.wait_for_audio)
+
+    def open_audio(self):
+        started = time.perf_counter()
+        try:
+            import pygame.mixer as mixer
+
+            mixer.init()
+            self.mixer = mixer
+            self.audio_open_time = (started, time.perf_counter())
+            self.audio_ready.set()
+        except ImportError:
+            self.audio_error = "Pygame not found. Please install Pygame."
+            print(self.audio_error)
+        except Exception as e:
+            self.audio_error = f"Could not open the audio device: {e}"
+            print(self.audio_error)
+        finally:
+            self.audio_opened.set()
+
+    def wait_for_audio(self):
+        if not self.audio_opened.is_set():
+            self.root.after(AUDIO_POLL_INTERVAL, self.wait_for_audio)
+            return
+        if self.audio_error is not None:
+            # Nothing can play, songs asked for so far are dropped
+            self.song_loader.cancel()
+            self.emit("error", self.audio_error)
+            return
+        self.mixer_events.start()
+        self.apply_volume()
+        self.emit("audio_ready")
+
+    # Audio calls before the mixer is open have nothing to act on
+    def busy(self):
+        return self.audio_ready.is_set() and self.mixer.music.get_busy()
+
+    # Seconds played of the current song
+    def position(self):
+        if not self.audio_ready.is_set():
+            return 0
+        return self.seek_offset + self.mixer.music.get_pos() / 1000
+
+    # Seconds left in the current song, None while paused
+    def time_left(self):
+        if self.paused:
+            return None
+        if not self.mixer.music.get_busy():
+            return 0
+        return self.song_length - self.position()
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.apply_volume()
+
+    # The volume of the slider scaled by the gain of the current song, the
+    # mixer can not play louder than 1
+    def apply_volume(self):
+        # Applied by wait_for_audio if the mixer is not open yet
+        if self.audio_ready.is_set():
+            self.song_loader.music_call(
+                self.mixer.music.set_volume, min(1.0, self.volume * self.gain)
+            )
+
+    # Pick the gain for a song from its measured loudness, songs that were
+    # not measured yet play at the volume of the slider
+    def update_gain(self, track):
+        loudness = self.library.loudness(track) if self.normalize else None
+        self.gain = 1.0 if loudness is None else loudness_gain(loudness)
+        self.apply_volume()
+
+    def set_normalize(self, enabled):
+        self.normalize = enabled
+        if self.busy() or self.paused:
+            self.update_gain(
+                self.library.get(self.track_store.path_at(self.current_song_index))
+            )
+
+    # The loudness of a song was measured, the current song changes volume
+    def loudness_measured(self, song_path):
+        if not (self.busy() or self.paused):
+            return
+        if self.track_store.path_at(self.current_song_index) == song_path:
+            self.update_gain(self.library.get(song_path))
+
+    # Load a song on the loader thread, song_loaded starts it once it is ready
+    def play(self, song_index):
+        if self.audio_error is not None:
+            self.emit("error", self.audio_error)
+            return
+        self.mixer_events.stop()
+        self.play_requested = time.perf_counter()
+        self.song_loader.load(
+            song_index, self.track_store.path_at(song_index), self.song_loaded
+        )
+
+    def song_loaded(self, song_index, track, error):
+        if error is not None:
+            self.emit("error", f"Could not play the song: {error}")
+            return
+        self.update_gain(track)
+        self.song_loader.music_call(self.mixer.music.play)
+        instrumentation.record("song switch", time.perf_counter() - self.play_requested)
+        if self.paused:
+            self.paused = False
+            self.emit("resumed")
+        self.song_started(song_index, track)
+
+    # Called whenever a new song started playing
+    def song_started(self, song_index, track):
+        self.current_song_index = song_index
+        self.song_length = track.duration
+        self.seek_offset = 0
+        if self.shuffle:
+            self.shuffle_order.started(self.track_store.track_id(song_index))
+        self.emit("song_started", song_index, track)
+        self.prefetch_upcoming()
+        self.mixer_events.watch()
+        self.queue_next_song()
+
+    def set_view(self, view):
+        self.view = view
+        if self.shuffle:
+            self.shuffle_order.reset(self.shuffle_candidates())
+
+    # Shuffle draws from the view, or from every song
+    def shuffle_candidates(self):
+        if self.view is None:
+            return None
+        return [self.track_store.track_id(position) for position in self.view]
+
+    # Turning shuffle on starts a new permutation, the list stays as it is
+    def set_shuffle(self, enabled):
+        self.shuffle = enabled
+        if enabled:
+            playing = None
+            if self.busy() or self.paused:
+                playing = self.track_store.track_id(self.current_song_index)
+            self.shuffle_order.reset(self.shuffle_candidates(), playing)
+            if playing is not None:
+                self.shuffle_order.started(playing)
+        self.emit("shuffle_changed", enabled)
+        if self.busy():
+            self.queue_next_song()
+
+    # Positions of up to `count` songs that play after the current one
+    def upcoming(self, count=1):
+        positions = []
+        if self.shuffle:
+            for ahead in range(1, count + 1):
+                track_id = self.shuffle_order.upcoming(ahead)
+                if track_id is None:
+                    break
+                positions.append(self.track_store.position_of(track_id))
+            return positions
+        position = self.current_song_index
+        for _ in range(count):
+            position = self.next_position(position)
+            if position is None:
+                break
+            positions.append(position)
+        return positions
+
+    # Position of the song played before the current one, for shuffle the
+    # one that really played before it
+    def previous(self):
+        if self.shuffle:
+            track_id = self.shuffle_order.previous()
+            if track_id is None:
+                return None
+            return self.track_store.position_of(track_id)
+        return self.prev_position(self.current_song_index)
+
+    # The position after or before `song_index` in the view, None at its end
+    def next_position(self, song_index):
+        if self.view is None:
+            if song_index + 1 < len(self.track_store):
+                return song_index + 1
+            return None
+        row = bisect_right(self.view, song_index)
+        return self.view[row] if row < len(self.view) else None
+
+    def prev_position(self, song_index):
+        if self.view is None:
+            return song_index - 1 if song_index > 0 else None
+        row = bisect_left(self.view, song_index)
+        return self.view[row - 1] if row > 0 else None
+
+    def next(self):
+        upcoming = self.upcoming()
+        if not upcoming:
+            return False
+        self.play(upcoming[0])
+        return True
+
+    def prev(self):
+        prev_song_index = self.previous()
+        if prev_song_index is None:
+            return False
+        self.play(prev_song_index)
+        return True
+
+    def toggle_pause(self):
+        if not self.audio_ready.is_set():
+            return
+        if self.paused == False and self.mixer.music.get_busy():
+            self.song_loader.music_call(self.mixer.music.pause)
+            self.paused = True
+            self.mixer_events.stop()
+            self.emit("paused")
+        else:
+            self.song_loader.music_call(self.mixer.music.unpause)
+            self.paused = False
+            self.emit("resumed")
+            if self.mixer.music.get_busy():
+                self.mixer_events.watch()
+
+    # Jump to `seconds` into the current song, also while paused
+    def seek(self, seconds):
+        if not (self.busy() or self.paused):
+            return False
+        seconds = max(0, min(seconds, self.song_length))
+        try:
+            # The song is being replaced when a load is running
+            if not self.song_loader.music_call(
+                self.mixer.music.set_pos, seconds, defer=False
+            ):
+                return False
+        except Exception as e:
+            self.emit("error", f"Could not seek in the song: {e}")
+            return False
+        self.seek_offset = seconds - self.mixer.music.get_pos() / 1000
+        # The end of the song moved
+        self.mixer_events.schedule()
+        self.emit("seeked", seconds)
+        return True
+
+    def stop(self):
+        if self.audio_ready.is_set():
+            self.song_loader.music_call(self.mixer.music.stop)
+        self.paused = False
+        self.current_song_index = 0
+        self.mixer_events.stop()
+        # Stopping the mixer also drops its queued song
+        self.queued_index = None
+        self.emit("song_stopped")
+        self.set_autoplay(False)
+
+    # Remove the songs at the given positions, returns their names
+    def remove(self, positions):
+        positions = sorted(set(positions))
+        song_names = [self.track_store.name_at(position) for position in positions]
+
+        def remove():
+            self.track_store.remove_many(positions)
+            return ()
+
+        self.change_queue(remove)
+        return song_names
+
+    def move_to_top(self, positions):
+        self.change_queue(lambda: self.track_store.move(positions, 0))
+
+    # Move the songs to right after the current one, or to the top when
+    # nothing is playing
+    def play_next(self, positions):
+        playing = self.busy() or self.paused
+        target = self.current_song_index + 1 if playing else 0
+        if playing and self.shuffle:
+            self.shuffle_order.play_next(
+                [self.track_store.track_id(position) for position in sorted(positions)]
+            )
+        self.change_queue(lambda: self.track_store.move(positions, target))
+
+    # Run `change`, which removes or moves songs in the track store and
+    # returns the new positions of moved songs. The current and queued song
+    # and the view are followed to their new positions by track id.
+    def change_queue(self, change):
+        track_store = self.track_store
+        current = None
+        if self.current_song_index < len(track_store):
+            current = track_store.track_id(self.current_song_index)
+        queued = None
+        if self.queued_index is not None and self.queued_index < len(track_store):
+            queued = track_store.track_id(self.queued_index)
+        view = None
+        if self.view is not None:
+            view = [track_store.track_id(position) for position in self.view]
+
+        selection = change()
+
+        current_removed = False
+        if current is not None:
+            position = track_store.position_of(current)
+            current_removed = position is None
+            self.current_song_index = position or 0
+        if queued is not None:
+            self.queued_index = track_store.position_of(queued)
+        if view is not None:
+            # Shuffle skips removed songs by itself and keeps its order
+            self.view = track_store.positions_of(view)
+        self.emit("queue_changed", selection)
+
+        if current_removed:
+            self.stop()
+        elif self.busy():
+            self.queue_next_song()
+
+    def set_autoplay(self, enabled):
+        self.autoplay = enabled
+        print("Autoplay enabled" if enabled else "Autoplay disabled")
+        self.emit("autoplay_changed", enabled)
+        if enabled:
+            if self.busy():
+                self.queue_next_song()
+            elif self.paused == False:
+                self.play_next_song()
+
+    # Gapless playback needs the mixer's end events to follow the switch.
+    # Returns False when it is unavailable.
+    def set_gapless(self, enabled):
+        if enabled and not self.mixer_events.events_available:
+            self.gapless = False
+            return False
+        self.gapless = enabled
+        if enabled and self.busy():
+            self.queue_next_song()
+        return True
+
+    # Called by the mixer event dispatcher when a song ended. A queued song
+    # still starts after autoplay was turned off, so the engine follows it.
+    def song_ended(self):
+        if self.queued_index is not None:
+            self.queued_song_started()
+        elif self.paused == False:
+            self.play_next_song()
+
+    def play_next_song(self):
+        if self.autoplay:
+            if not self.next():
+                print("No more songs in the list")
+                self.set_autoplay(False)
+
+    # The mixer moved on to the queued song by itself
+    def queued_song_started(self):
+        next_song_index = self.queued_index
+        self.queued_index = None
+        if next_song_index < len(self.track_store):
+            song_path = self.track_store.path_at(next_song_index)
+            track = self.library.lookup(song_path)
+            self.update_gain(track)
+            self.song_started(next_song_index, track)
+
+    # Hand the next song to the mixer so it starts without a gap
+    def queue_next_song(self):
+        self.queued_index = None
+        if not self.autoplay or not self.gapless:
+            return
+        upcoming = self.upcoming()
+        if upcoming:
+            # During a load the loaded song queues its own next song
+            if self.song_loader.music_call(
+                self.mixer.music.queue,
+                self.track_store.path_at(upcoming[0]),
+                defer=False,
+            ):
+                self.queued_index = upcoming[0]
+
+    # Warm the songs around the current one so switching to them is instant
+    def prefetch_upcoming(self):
+        song_paths = [
+            self.track_store.path_at(position)
+            for position in self.upcoming(PREFETCH_COUNT)
+        ]
+        position = self.previous()
+        if position is not None:
+            song_paths.append(self.track_store.path_at(position))
+        self.prefetcher.prefetch(song_paths)
+
+    def shutdown(self):
+        self.mixer_events.stop()
+        self.prefetcher.shutdown()
+        self.song_loader.shutdown()
@@ -0,0 +1,155 @@
+import os
+import json
+
+try:
+    from tkinter import PhotoImage, TclError
+except ImportError:
+    print("Tkinter not found. Please install Tkinter.")
+
+
+ICON_CACHE_DIR = "icon_cache"
+ATLAS_WIDTH = 512
+
+
+# Hands out button images, each decoded once per size and then shared by
+# every button that shows it, so swapping images never touches the disk.
+# Icons come from a single sprite atlas built on the first run, or from
+# resized PNGs kept on disk that Tk can load by itself. Pillow is only
+# imported when an icon has to be rendered.
+class IconCache:
+    def __init__(self, directory=ICON_CACHE_DIR, atlas=True):
+        self.directory = directory
+        self.use_atlas = atlas
+        self.photos = {}
+        self.atlas_image = None
+        self.atlas_icons = {}
+        self.atlas_stale = False
+        if atlas:
+            self.load_atlas()
+
+    def key(self, image_path, size):
+        return f"{image_path}|{size[0]}x{size[1]}"
+
+    def photo(self, image_path, size):
+        key = self.key(image_path, size)
+        photo = self.photos.get(key)
+        if photo is None:
+            photo = self.from_atlas(key)
+            if photo is None:
+                photo = self.from_file(image_path, size)
+            self.photos[key] = photo
+        return photo
+
+    # Decode images now that are only shown later, e.g. after a toggle
+    def preload(self, icons):
+        for image_path, size in icons:
+            self.photo(image_path, size)
+
+    def from_atlas(self, key):
+        entry = self.atlas_icons.get(key)
+        if entry is None:
+            self.atlas_stale = self.use_atlas
+            return None
+        x, y, width, height = entry["box"]
+        photo = PhotoImage(width=width, height=height)
+        photo.tk.call(
+            photo, "copy", self.atlas_image, "-from", x, y, x + width, y + height
+        )
+        return photo
+
+    def path(self, image_path, size):
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.directory, f"{name}_{size[0]}x{size[1]}.png")
+
+    def from_file(self, image_path, size):
+        cached_path = self.path(image_path, size)
+        try:
+            if os.path.getmtime(cached_path) >= os.path.getmtime(image_path):
+                return PhotoImage(file=cached_path)
+        except OSError:
+            pass
+        return self.render(image_path, size, cached_path)
+
+    def render(self, image_path, size, cached_path):
+        from PIL import Image, ImageTk
+
+        img = Image.open(image_path).resize(size, Image.LANCZOS)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            img.save(cached_path + ".tmp", "PNG")
+            os.replace(cached_path + ".tmp", cached_path)
+        except OSError as e:
+            print(f"Could not save icon {cached_path}: {e}")
+        return ImageTk.PhotoImage(img)
+
+    def atlas_paths(self):
+        return (
+            os.path.join(self.directory, "atlas.png"),
+            os.path.join(self.directory, "atlas.json"),
+        )
+
+    def load_atlas(self):
+        atlas_path, index_path = self.atlas_paths()
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            icons = {}
+            for key, entry in index.items():
+                # Icons whose source image changed are rendered again
+                if os.path.getmtime(entry["path"]) == entry["mtime"]:
+                    icons[key] = entry
+            self.atlas_image = PhotoImage(file=atlas_path)
+            self.atlas_icons = icons
+        except (OSError, ValueError, KeyError, TclError):
+            self.atlas_icons = {}
+
+    # Pack every icon used so far into one image that is loaded in one go on
+    # the next start. Only does work when some icon was not in the atlas.
+    def save_atlas(self):
+        if not self.use_atlas or not self.atlas_stale:
+            return
+        try:
+            from PIL import Image
+        except ImportError:
+            print("Pillow not found. Please install Pillow.")
+            return
+
+        images = []
+        for key in self.photos:
+            image_path, size = key.rsplit("|", 1)
+            size = tuple(int(side) for side in size.split("x"))
+            img = Image.open(image_path).convert("RGBA").resize(size, Image.LANCZOS)
+            images.append((key, image_path, img))
+
+        # Shelf packing: rows of icons sorted by height
+        images.sort(key=lambda item: -item[2].height)
+        index = {}
+        x = y = row_height = 0
+        for key, image_path, img in images:
+            if x + img.width > ATLAS_WIDTH:
+                x = 0
+                y += row_height
+                row_height = 0
+            index[key] = {
+                "path": image_path,
+                "mtime": os.path.getmtime(image_path),
+                "box": [x, y, img.width, img.height],
+            }
+            x += img.width
+            row_height = max(row_height, img.height)
+
+        atlas = Image.new("RGBA", (ATLAS_WIDTH, max(y + row_height, 1)))
+        for key, image_path, img in images:
+            box = index[key]["box"]
+            atlas.paste(img, (box[0], box[1]))
+
+        atlas_path, index_path = self.atlas_paths()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            atlas.save(atlas_path + ".tmp", "PNG")
+            os.replace(atlas_path + ".tmp", atlas_path)
+            with open(index_path, "w") as f:
+                json.dump(index, f)
+            self.atlas_stale = False
+        except OSError as e:
+            print(f"Could not save icon atlas {atlas_path}: {e}")
@@ -0,0 +1,358 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+from profiler import instrumentation
+from mp3_reader import read_mp3, read_art, data_art_digest
+from duplicates import full_hash
+
+LIBRARY_DB = "library.db"
+
+TrackInfo = namedtuple(
+    "TrackInfo",
+    ["path", "size", "mtime", "duration", "title", "artist", "album", "art_digest"],
+)
+
+
+# mutagen is only needed for tags the header reader does not handle, and
+# only imported when the first such file has to be parsed
+def open_mp3(path):
+    try:
+        from mutagen.mp3 import MP3
+        from mutagen.id3 import ID3
+    except ImportError:
+        print("Mutagen not found. Please install Mutagen.")
+        raise
+    return MP3(path, ID3=ID3)
+
+
+# On-disk index of every song the player has seen. A file is only parsed
+# again when its size or modification time changed.
+class LibraryIndex:
+    def __init__(self, db_path=LIBRARY_DB):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                duration REAL,
+                title TEXT,
+                artist TEXT,
+                album TEXT,
+                art_digest TEXT
+            )""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS playlist (
+                position INTEGER PRIMARY KEY,
+                path TEXT
+            )""")
+        # Seek bar peaks as written by waveform.compute_peaks
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS waveforms (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                peaks BLOB
+            )""")
+        # Hashes of file contents as computed by the duplicate finder
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS content_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                partial TEXT,
+                full TEXT
+            )""")
+        # Folders watched for songs that are added, removed or renamed
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS folders (
+                path TEXT PRIMARY KEY
+            )""")
+        # Songs taken off the list by hand, the folder watcher leaves them out
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS excluded (
+                path TEXT PRIMARY KEY
+            )""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS loudness (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                lufs REAL
+            )""")
+        # Art digests before version 1 only covered the start of the picture,
+        # songs with album art are parsed again
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < 1:
+            self.connection.execute("DELETE FROM tracks WHERE art_digest IS NOT NULL")
+            self.connection.execute("PRAGMA user_version = 1")
+        self.connection.commit()
+        self.tracks = {}
+        # Path -> (size, mtime, partial hash, full hash)
+        self.content_hashes = {}
+        # Path -> (size, mtime, loudness in LUFS)
+        self.loudness_values = {}
+
+    # Load the whole index once so lookups during playback never hit the disk
+    def load(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM tracks").fetchall()
+            loudness_rows = self.connection.execute("SELECT * FROM loudness").fetchall()
+            hash_rows = self.connection.execute(
+                "SELECT * FROM content_hashes"
+            ).fetchall()
+        for row in rows:
+            # Entries parsed before the index was loaded are newer
+            self.tracks.setdefault(row[0], TrackInfo(*row))
+        for path, size, mtime, lufs in loudness_rows:
+            self.loudness_values.setdefault(path, (size, mtime, lufs))
+        for row in hash_rows:
+            self.content_hashes.setdefault(row[0], row[1:])
+
+    # Return the cached entry without checking the file on disk
+    def get(self, path):
+        track = self.tracks.get(path)
+        if track is None:
+            track = self.lookup(path)
+        return track
+
+    # Return an up to date entry, re-parsing the file only if it changed
+    def lookup(self, path):
+        track, changed = self.refresh(path)
+        if changed:
+            self.store([track])
+        return track
+
+    # Same as lookup for many files, written to the database in one transaction
+    def lookup_many(self, paths):
+        tracks = []
+        changed_tracks = []
+        for path in paths:
+            track, changed = self.refresh(path)
+            tracks.append(track)
+            if changed:
+                changed_tracks.append(track)
+        self.store(changed_tracks)
+        return tracks
+
+    def refresh(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return (
+                self.tracks.get(path)
+                or TrackInfo(path, 0, 0, 0, None, None, None, None),
+                False,
+            )
+
+        track = self.tracks.get(path)
+        if track and track.size == stat.st_size and track.mtime == stat.st_mtime_ns:
+            return track, False
+
+        track = self.parse(path, stat)
+        self.tracks[path] = track
+        return track, True
+
+    # Only the headers are read, the picture and the audio are left on disk
+    def parse(self, path, stat):
+        duration = 0
+        title = artist = album = digest = None
+        try:
+            with instrumentation.measure("tag parse"):
+                header = read_mp3(path)
+            duration = header.duration
+            title = header.title
+            artist = header.artist
+            album = header.album
+            digest = header.art_digest
+        except Exception:
+            # Anything the fast reader gets wrong would stay in the index
+            duration, title, artist, album, digest = self.parse_with_mutagen(path)
+
+        return TrackInfo(
+            path,
+            stat.st_size,
+            stat.st_mtime_ns,
+            duration,
+            title,
+            artist,
+            album,
+            digest,
+        )
+
+    def parse_with_mutagen(self, path):
+        duration = 0
+        title = artist = album = digest = None
+        try:
+            with instrumentation.measure("tag parse (mutagen)"):
+                audio = open_mp3(path)
+                duration = audio.info.length
+                if audio.tags is not None:
+                    title = self.text_frame(audio.tags, "TIT2")
+                    artist = self.text_frame(audio.tags, "TPE1")
+                    album = self.text_frame(audio.tags, "TALB")
+                    album_art = self.first_picture(audio.tags)
+                    if album_art is not None:
+                        digest = data_art_digest(album_art.data)
+        except Exception as e:
+            print(f"Could not read tags from {path}: {e}")
+        return duration, title, artist, album, digest
+
+    def text_frame(self, tags, frame_id):
+        frame = tags.get(frame_id)
+        if frame is not None and frame.text:
+            return str(frame.text[0])
+        return None
+
+    def store(self, tracks):
+        if not tracks:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                tracks,
+            )
+            self.connection.commit()
+
+    def first_picture(self, tags):
+        for tag in tags.values():
+            if tag.FrameID.startswith("APIC"):
+                return tag
+        return None
+
+    # Bytes of the first embedded picture of the song, or None. Only the
+    # picture itself is read once the headers said where it is.
+    def album_art_data(self, path):
+        try:
+            header = read_mp3(path)
+        except Exception:
+            audio = open_mp3(path)
+            if audio.tags is None:
+                return None
+            album_art = self.first_picture(audio.tags)
+            return None if album_art is None else album_art.data
+        if header.art_offset is None:
+            return None
+        return read_art(path, header.art_offset, header.art_length)
+
+    # Hash of the whole file, used to spot the same song under another name
+    def content_digest(self, path):
+        track = self.get(path)
+        partial, digest = self.cached_hashes(track)
+        if digest is None:
+            try:
+                digest = full_hash(path)
+            except OSError:
+                return path
+            self.save_hashes([(track, partial, digest)])
+        return digest
+
+    # (partial hash, full hash) of the song, None for hashes that were not
+    # computed for this version of the file
+    def cached_hashes(self, track):
+        value = self.content_hashes.get(track.path)
+        if value is None or value[:2] != (track.size, track.mtime):
+            return None, None
+        return value[2], value[3]
+
+    # Store (track, partial hash, full hash) rows in one transaction
+    def save_hashes(self, hashes):
+        if not hashes:
+            return
+        rows = [
+            (track.path, track.size, track.mtime, partial, full)
+            for track, partial, full in hashes
+        ]
+        for row in rows:
+            self.content_hashes[row[0]] = row[1:]
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO content_hashes VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self.connection.commit()
+
+    # Peaks of the song, None unless they were computed for this version of
+    # the file
+    def waveform(self, track):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT peaks FROM waveforms WHERE path = ? AND size = ? AND mtime = ?",
+                (track.path, track.size, track.mtime),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def save_waveform(self, track, peaks):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO waveforms VALUES (?, ?, ?, ?)",
+                (track.path, track.size, track.mtime, peaks),
+            )
+            self.connection.commit()
+
+    # Loudness of the song in LUFS, None unless it was measured for this
+    # version of the file
+    def loudness(self, track):
+        value = self.loudness_values.get(track.path)
+        if value is None or value[:2] != (track.size, track.mtime):
+            return None
+        return value[2]
+
+    # Store (track, loudness) pairs in one transaction
+    def save_loudness(self, measured):
+        if not measured:
+            return
+        rows = [(track.path, track.size, track.mtime, lufs) for track, lufs in measured]
+        for row in rows:
+            self.loudness_values[row[0]] = row[1:]
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?)", rows
+            )
+            self.connection.commit()
+
+    def load_folders(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT path FROM folders").fetchall()
+        return [row[0] for row in rows]
+
+    def add_folder(self, path):
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO folders VALUES (?)", (path,))
+            self.connection.commit()
+
+    def load_excluded(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT path FROM excluded").fetchall()
+        return {row[0] for row in rows}
+
+    # Add the paths to the excluded songs, or take them out for False
+    def set_excluded(self, paths, excluded=True):
+        rows = [(path,) for path in paths]
+        if not rows:
+            return
+        with self.lock:
+            if excluded:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO excluded VALUES (?)", rows
+                )
+            else:
+                self.connection.executemany("DELETE FROM excluded WHERE path = ?", rows)
+            self.connection.commit()
+
+    # The song list of the last session, in order
+    def load_playlist(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT path FROM playlist ORDER BY position"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def save_playlist(self, paths):
+        with self.lock:
+            self.connection.execute("DELETE FROM playlist")
+            self.connection.executemany(
+                "INSERT INTO playlist VALUES (?, ?)", enumerate(paths)
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,131 @@
+import queue
+import threading
+
+from profiler import instrumentation
+
+DRAIN_INTERVAL = 10
+
+
+# Loads songs on a worker thread: mixer.music.load, the library lookup and
+# the album art thumbnail all happen there, and the UI thread only gets the
+# result through a queue drained with window.after. Only the newest request
+# matters, so requests that were superseded before the worker got to them
+# are skipped and results of superseded requests are dropped. Other
+# mixer.music calls go through music_call, so they never run during a load
+# and the UI thread never waits for one.
+class SongLoader:
+    def __init__(self, root, library, album_art_cache, audio_ready, audio_opened):
+        self.root = root
+        # Set once the audio device was opened in the background, and once
+        # opening it is over whether it worked or not
+        self.audio_ready = audio_ready
+        self.audio_opened = audio_opened
+        # Only held for a moment, never across a load
+        self.music_lock = threading.Lock()
+        self.loading = False
+        # mixer.music calls made during the load, run right after it
+        self.deferred = []
+        self.library = library
+        self.album_art_cache = album_art_cache
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.after_id = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Called on the UI thread, `on_loaded(song_index, track, error)` runs on
+    # the UI thread once the song is ready to play
+    def load(self, song_index, song_path, on_loaded):
+        self.generation += 1
+        self.requests.put((self.generation, song_index, song_path, on_loaded))
+        if self.after_id is None:
+            self.after_id = self.root.after(DRAIN_INTERVAL, self.drain)
+
+    # Run a mixer.music call on the UI thread unless a song is loading, then
+    # it runs on the loader thread after the load, or is dropped when
+    # `defer` is False. Returns whether it ran right away.
+    def music_call(self, function, *args, defer=True):
+        with self.music_lock:
+            if not self.loading:
+                function(*args)
+                return True
+            if defer:
+                self.deferred.append((function, args))
+            return False
+
+    def run(self):
+        self.audio_opened.wait()
+        if not self.audio_ready.is_set():
+            return
+        import pygame.mixer as mixer
+
+        while True:
+            request = self.requests.get()
+            # Jump to the newest request, the others were superseded
+            while True:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+            if request is None:
+                return
+            generation, song_index, song_path, on_loaded = request
+            if generation != self.generation:
+                continue
+
+            track = None
+            error = None
+            try:
+                track = self.library.lookup(song_path)
+                self.load_music(mixer, song_path)
+                if track.art_digest is not None and self.album_art_cache is not None:
+                    self.album_art_cache.prefetch(
+                        track.art_digest,
+                        lambda: self.library.album_art_data(song_path),
+                    )
+            except Exception as e:
+                error = e
+            self.results.put((generation, song_index, track, error, on_loaded))
+
+    def load_music(self, mixer, song_path):
+        with self.music_lock:
+            self.loading = True
+        try:
+            with instrumentation.measure("mixer load"):
+                mixer.music.load(song_path)
+        finally:
+            with self.music_lock:
+                self.loading = False
+                for function, args in self.deferred:
+                    try:
+                        function(*args)
+                    except Exception as e:
+                        print(f"Mixer call {function.__name__} failed: {e}")
+                self.deferred.clear()
+
+    def drain(self):
+        self.after_id = None
+        done = False
+        while True:
+            try:
+                generation, song_index, track, error, on_loaded = (
+                    self.results.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                done = True
+                on_loaded(song_index, track, error)
+        if not done:
+            self.after_id = self.root.after(DRAIN_INTERVAL, self.drain)
+
+    # Drop the requests made so far and stop waiting for their results
+    def cancel(self):
+        self.generation += 1
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def shutdown(self):
+        self.requests.put(None)
@@ -0,0 +1,206 @@
+import os
+import queue
+from collections import deque
+
+from waveform import init_worker, start_pool, decode
+
+# ReplayGain 2.0 reference loudness
+TARGET_LOUDNESS = -18.0
+# Loudness stored for songs that are silent, below the absolute gate
+SILENT_LOUDNESS = -70.0
+BLOCK_SECONDS = 0.4
+# Blocks transformed at once, bounds the memory a worker needs
+BLOCKS_PER_BATCH = 64
+# Memory a worker needs for a whole decoded song, ten minutes of 44.1 kHz
+# stereo are about 100 MB, plus the blocks being transformed
+WORKER_MEMORY = 160 * 1024 * 1024
+# Songs handed to each worker ahead, so songs asked for first wait little
+SONGS_PER_WORKER = 2
+WORKER_NICENESS = 10
+DRAIN_INTERVAL = 200
+
+
+# Bytes of memory available to new processes, None if it is not known
+def available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+# One worker per core, as many as fit in the available memory
+def analysis_workers():
+    workers = os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, memory // WORKER_MEMORY)
+    return max(1, workers)
+
+
+# K-weighting filter of ITU-R BS.1770 for 48 kHz, a high shelf followed by
+# a high pass, as (b, a) biquad coefficients
+K_WEIGHTING = (
+    (
+        (1.53512485958697, -2.69169618940638, 1.19839281085285),
+        (1.0, -1.69065929318241, 0.73248077421585),
+    ),
+    ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)),
+)
+
+
+# Analysis shares the machine with playback, workers run at a lower priority
+def init_analysis_worker():
+    init_worker()
+    if hasattr(os, "nice"):
+        os.nice(WORKER_NICENESS)
+
+
+# Squared magnitude of the K-weighting filter at the given frequencies
+def k_weighting(frequencies):
+    import numpy
+
+    z = numpy.exp(-2j * numpy.pi * frequencies / 48000)
+    response = numpy.ones(len(frequencies))
+    for b, a in K_WEIGHTING:
+        numerator = b[0] + b[1] * z + b[2] * z * z
+        denominator = a[0] + a[1] * z + a[2] * z * z
+        response *= numpy.abs(numerator / denominator) ** 2
+    return response
+
+
+# Integrated loudness of a song in LUFS, following BS.1770 with gated 400 ms
+# blocks. Blocks do not overlap and the K-weighting is applied to each
+# block's spectrum, which is close enough to pick a playback volume.
+def measure_loudness(path):
+    import numpy
+
+    samples, sample_rate = decode(path)
+    block = int(sample_rate * BLOCK_SECONDS)
+    blocks = len(samples) // block
+    if blocks == 0:
+        return SILENT_LOUDNESS
+    scale = float(numpy.iinfo(samples.dtype).max + 1)
+    blocked = samples[: blocks * block].reshape(blocks, block, samples.shape[1])
+
+    weights = k_weighting(numpy.fft.rfftfreq(block, 1 / sample_rate))
+    # Parseval: every bin but DC and Nyquist stands for two of the full FFT
+    weights[1 : (block + 1) // 2] *= 2
+    powers = numpy.empty(blocks)
+    for first in range(0, blocks, BLOCKS_PER_BATCH):
+        batch = blocked[first : first + BLOCKS_PER_BATCH] / scale
+        spectrum = numpy.fft.rfft(batch, axis=1)
+        energy = numpy.abs(spectrum) ** 2 * weights[:, None]
+        # Mean square per channel, summed over the channels
+        powers[first : first + len(batch)] = energy.sum(axis=(1, 2)) / block**2
+
+    with numpy.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * numpy.log10(powers)
+    gated = powers[loudness > SILENT_LOUDNESS]
+    if len(gated) == 0:
+        return SILENT_LOUDNESS
+    relative_gate = -0.691 + 10 * numpy.log10(gated.mean()) - 10
+    gated = powers[(loudness > SILENT_LOUDNESS) & (loudness > relative_gate)]
+    return float(-0.691 + 10 * numpy.log10(gated.mean()))
+
+
+# Volume factor that brings a song of `loudness` LUFS to the target
+def loudness_gain(loudness):
+    return 10 ** ((TARGET_LOUDNESS - loudness) / 20)
+
+
+# Measures the loudness of every song in a TrackStore in a pool of worker
+# processes, one per core unless memory runs short. Songs are handed out a
+# few at a time so songs asked for with prioritize(), like the one that just
+# started, do not wait behind the whole library. Results are stored in the
+# library index keyed by the file's size and modification time, so only new
+# or changed songs are measured again.
+class LoudnessAnalyzer:
+    def __init__(self, root, library, track_store, on_measured=None):
+        self.root = root
+        self.library = library
+        self.track_store = track_store
+        # Called on the UI thread with the path of every song measured
+        self.on_measured = on_measured
+        self.workers = analysis_workers()
+        self.pool = None
+        self.available = True
+        self.waiting = deque()
+        self.running = {}
+        self.failed = set()
+        self.results = queue.Queue()
+        # Track ids below this one were queued, ids are never reused
+        self.queued = 0
+        self.after_id = None
+
+    # Queue the songs added to the store since the last call
+    def update(self):
+        track_names = self.track_store.track_names
+        for track_id in range(self.queued, len(track_names)):
+            if track_names[track_id] is not None:
+                self.waiting.append(self.track_store.path(track_id))
+        self.queued = len(track_names)
+        self.fill()
+
+    # Measure these songs before the others
+    def prioritize(self, paths):
+        self.waiting.extendleft(reversed(paths))
+        self.fill()
+
+    def fill(self):
+        while self.available and self.waiting:
+            if len(self.running) >= self.workers * SONGS_PER_WORKER:
+                break
+            path = self.waiting.popleft()
+            if path in self.running or path in self.failed:
+                continue
+            track = self.library.get(path)
+            if track.size == 0 or self.library.loudness(track) is not None:
+                continue
+
+            if self.pool is None:
+                self.pool = start_pool(self.workers, init_analysis_worker)
+            future = self.pool.submit(measure_loudness, path)
+            self.running[path] = track
+            future.add_done_callback(
+                lambda future, track=track: self.results.put((track, future))
+            )
+        if self.running and self.after_id is None:
+            self.after_id = self.root.after(DRAIN_INTERVAL, self.drain)
+
+    def drain(self):
+        self.after_id = None
+        measured = []
+        while True:
+            try:
+                track, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            del self.running[track.path]
+            try:
+                measured.append((track, future.result()))
+            except ImportError:
+                print("NumPy not found. Please install NumPy.")
+                self.available = False
+            except Exception as e:
+                print(f"Could not measure the loudness of {track.path}: {e}")
+                self.failed.add(track.path)
+        self.library.save_loudness(measured)
+        if self.on_measured is not None:
+            for track, loudness in measured:
+                self.on_measured(track.path)
+        self.fill()
+
+    def pending(self):
+        return len(self.waiting) + len(self.running)
+
+    def shutdown(self):
+        self.waiting.clear()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
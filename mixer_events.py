@@ -0,0 +1,99 @@
+# How long before the expected end of a song to start pumping events fast
+NEAR_END = 0.1
+FAST_INTERVAL = 5
+OVERDUE_INTERVAL = 100
+PAUSED_INTERVAL = 1000
+# Longest sleep while a song plays, song lengths from the header can be too
+# long and the end of the song must not be missed by more than this
+MAX_INTERVAL = 1000
+
+
+# Moves pygame mixer events into the Tk main loop. While a song plays the
+# dispatcher sleeps in window.after calls of up to a second until shortly
+# before the song is due to end, then pumps pygame events every few milliseconds until the
+# end event arrives. Nothing runs while no song is playing, or before
+# start() was called once the audio device is open.
+class MixerEventDispatcher:
+    def __init__(self, root, time_left):
+        self.root = root
+        # Returns the seconds left in the current song, None while paused
+        self.time_left = time_left
+        self.handlers = []
+        self.after_id = None
+        self.watching = False
+        self.started = False
+        self.events_available = False
+        self.pygame = None
+        self.end_event = None
+
+    # Called on the Tk thread after pygame.mixer was initialized
+    def start(self):
+        import pygame
+
+        self.pygame = pygame
+        # Posted by the mixer when a song ends or a queued song takes over
+        self.end_event = pygame.USEREVENT + 1
+        try:
+            # The event queue is part of pygame's display module
+            pygame.display.init()
+            pygame.mixer.music.set_endevent(self.end_event)
+            self.events_available = True
+        except pygame.error as e:
+            print("Mixer events unavailable, watching the mixer instead:", str(e))
+        self.started = True
+        self.schedule()
+
+    def connect(self, handler):
+        self.handlers.append(handler)
+
+    # Start waiting for the end of the song that just started
+    def watch(self):
+        if self.events_available:
+            self.pygame.event.clear(self.end_event)
+        self.watching = True
+        self.schedule()
+
+    def stop(self):
+        self.watching = False
+        self.schedule()
+
+    def schedule(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        if not self.watching or not self.started:
+            return
+
+        time_left = self.time_left()
+        if time_left is None:
+            delay = PAUSED_INTERVAL
+        elif time_left > NEAR_END:
+            delay = min(int((time_left - NEAR_END) * 1000), MAX_INTERVAL)
+        elif time_left > -0.5:
+            delay = FAST_INTERVAL
+        else:
+            # The song runs longer than its header said
+            delay = OVERDUE_INTERVAL
+        self.after_id = self.root.after(delay, self.pump)
+
+    def pump(self):
+        self.after_id = None
+        ended = self.events_available and bool(self.pygame.event.get(self.end_event))
+        # A stopped mixer also counts, in case the event never comes
+        if not ended:
+            music = self.pygame.mixer.music
+            ended = not music.get_busy() and self.time_left() is not None
+
+        if ended:
+            # Handlers that start another song call watch() again
+            self.watching = False
+            for handler in list(self.handlers):
+                try:
+                    handler()
+                except Exception as e:
+                    print("Error in mixer event handler:", str(e))
+        self.schedule()
+
+    # Number of pending after() chains (0 or 1)
+    def active_callbacks(self):
+        return 0 if self.after_id is None else 1
@@ -0,0 +1,309 @@
+import os
+import struct
+import hashlib
+from collections import namedtuple
+
+# Bytes of an embedded picture hashed for its digest, so the digest never
+# needs the whole picture
+ART_DIGEST_BYTES = 4096
+# How far past the ID3v2 tag to look for the first MPEG frame
+SYNC_SEARCH_BYTES = 16 * 1024
+TEXT_FRAME_LIMIT = 64 * 1024
+READ_BUFFER = 4096
+
+Mp3Header = namedtuple(
+    "Mp3Header",
+    ["duration", "title", "artist", "album", "art_offset", "art_length", "art_digest"],
+)
+
+TEXT_FRAMES = {
+    "TIT2": "title",
+    "TPE1": "artist",
+    "TALB": "album",
+    "TT2": "title",
+    "TP1": "artist",
+    "TAL": "album",
+}
+
+# Bit rates in kbit/s by (MPEG-1, layer) and (MPEG-2/2.5, layer)
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+
+# Raised for files this reader does not handle, e.g. unsynchronised or
+# compressed frames, or audio that starts too far after the tag. The caller
+# falls back to a full parser.
+class UnsupportedTag(Exception):
+    pass
+
+
+# Digest of a picture from its length, its first bytes and its last bytes.
+# Pictures often share long EXIF or ICC headers, the end tells them apart.
+def art_digest(head, tail, length):
+    return hashlib.sha1(b"%d:" % length + head + tail).hexdigest()
+
+
+# Where the tail sample of a picture of `length` bytes starts, it does not
+# overlap the head sample
+def art_tail_start(length):
+    return max(ART_DIGEST_BYTES, length - ART_DIGEST_BYTES)
+
+
+def data_art_digest(data):
+    return art_digest(
+        data[:ART_DIGEST_BYTES], data[art_tail_start(len(data)) :], len(data)
+    )
+
+
+def syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def decode_text(encoding, data):
+    if encoding == 0:
+        text = data.decode("latin-1")
+    elif encoding == 1:
+        text = data.decode("utf-16")
+    elif encoding == 2:
+        text = data.decode("utf-16-be")
+    else:
+        text = data.decode("utf-8")
+    # Several values are separated by NUL, like mutagen the first one is used
+    return text.split("\0")[0] or None
+
+
+# Length of a NUL terminated string in the given encoding, terminator included
+def terminated_length(encoding, data, start):
+    if encoding in (1, 2):
+        end = start
+        while end + 1 < len(data):
+            if data[end] == 0 and data[end + 1] == 0:
+                return end + 2 - start
+            end += 2
+        raise UnsupportedTag("picture description is not terminated")
+    end = data.find(b"\0", start)
+    if end < 0:
+        raise UnsupportedTag("picture description is not terminated")
+    return end + 1 - start
+
+
+# Reads duration, title, artist, album and where the first embedded picture
+# is from an MP3 without reading the picture or the audio. Only the ID3v2
+# frame headers, the text frames, the first MPEG frame and the ID3v1 block at
+# the end are read, a few KB per file.
+def read_mp3(path):
+    size = os.path.getsize(path)
+    tags = {}
+    art = None
+    with open(path, "rb", buffering=READ_BUFFER) as f:
+        header = f.read(10)
+        audio_start = 0
+        if len(header) == 10 and header[:3] == b"ID3":
+            audio_start, art = read_id3v2(f, header, tags)
+
+        f.seek(audio_start)
+        duration = read_duration(f.read(SYNC_SEARCH_BYTES), audio_start, size)
+        if duration is None:
+            raise UnsupportedTag("no MPEG frame found after the tag")
+
+        if size >= 128:
+            f.seek(size - 128)
+            trailer = f.read(128)
+            if trailer[:3] == b"TAG":
+                if duration[1]:
+                    # Constant bit rate, the ID3v1 block is no audio
+                    duration = (duration[0] - 128 * 8 / duration[1], duration[1])
+                for name, start in (("title", 3), ("artist", 33), ("album", 63)):
+                    if name not in tags:
+                        text = trailer[start : start + 30].split(b"\0")[0]
+                        text = text.decode("latin-1").strip()
+                        if text:
+                            tags[name] = text
+
+        digest = None
+        if art is not None:
+            offset, length = art
+            f.seek(offset)
+            head = f.read(min(length, ART_DIGEST_BYTES))
+            tail_start = art_tail_start(length)
+            tail = b""
+            if tail_start < length:
+                f.seek(offset + tail_start)
+                tail = f.read(length - tail_start)
+            digest = art_digest(head, tail, length)
+
+    return Mp3Header(
+        duration[0],
+        tags.get("title"),
+        tags.get("artist"),
+        tags.get("album"),
+        art[0] if art else None,
+        art[1] if art else None,
+        digest,
+    )
+
+
+# Walk the ID3v2 frames, returns where the audio starts and the offset and
+# length of the first picture
+def read_id3v2(f, header, tags):
+    version = header[3]
+    flags = header[5]
+    tag_end = 10 + syncsafe(header[6:10])
+    if version == 4 and flags & 0x10:
+        audio_start = tag_end + 10
+    else:
+        audio_start = tag_end
+    if version not in (2, 3, 4):
+        return audio_start, None
+    if flags & 0x80:
+        raise UnsupportedTag("unsynchronised tag")
+
+    position = 10
+    if flags & 0x40 and version in (3, 4):
+        extended = f.read(4)
+        if version == 3:
+            position += 4 + struct.unpack(">I", extended)[0]
+        else:
+            position += syncsafe(extended)
+
+    header_size = 6 if version == 2 else 10
+    art = None
+    while position + header_size <= tag_end:
+        f.seek(position)
+        frame_header = f.read(header_size)
+        if len(frame_header) < header_size or frame_header[0] == 0:
+            # Padding
+            break
+        if version == 2:
+            frame_id = frame_header[:3].decode("latin-1")
+            frame_size = int.from_bytes(frame_header[3:6], "big")
+            frame_flags = 0
+        else:
+            frame_id = frame_header[:4].decode("latin-1")
+            if version == 4:
+                frame_size = syncsafe(frame_header[4:8])
+            else:
+                frame_size = struct.unpack(">I", frame_header[4:8])[0]
+            frame_flags = struct.unpack(">H", frame_header[8:10])[0]
+        data_start = position + header_size
+        position = data_start + frame_size
+        if position > tag_end:
+            break
+
+        wanted = frame_id in TEXT_FRAMES or (
+            art is None and frame_id in ("APIC", "PIC")
+        )
+        if not wanted:
+            continue
+        if version == 4:
+            if frame_flags & 0x000E:
+                raise UnsupportedTag(f"{frame_id} is compressed or encrypted")
+            if frame_flags & 0x0001:
+                data_start += 4
+        elif version == 3:
+            if frame_flags & 0x00C0:
+                raise UnsupportedTag(f"{frame_id} is compressed or encrypted")
+            if frame_flags & 0x0020:
+                data_start += 1
+        data_size = position - data_start
+        f.seek(data_start)
+
+        if frame_id in TEXT_FRAMES:
+            name = TEXT_FRAMES[frame_id]
+            if name not in tags and 0 < data_size <= TEXT_FRAME_LIMIT:
+                data = f.read(data_size)
+                text = decode_text(data[0], data[1:])
+                if text:
+                    tags[name] = text
+        else:
+            # Only the fields in front of the picture are read
+            data = f.read(min(data_size, 1024))
+            encoding = data[0]
+            if frame_id == "PIC":
+                start = 5
+            else:
+                start = 1 + terminated_length(0, data, 1) + 1
+            start += terminated_length(encoding, data, start)
+            art = (data_start + start, data_size - start)
+    return audio_start, art
+
+
+# Parse the first MPEG audio frame found in `data`, which starts at
+# `audio_start` in a file of `size` bytes. Returns (seconds, bits per
+# second) with the bit rate None for variable bit rate files.
+def read_duration(data, audio_start, size):
+    index = data.find(b"\xff")
+    while 0 <= index <= len(data) - 4:
+        frame = parse_frame_header(data[index : index + 4])
+        if frame is not None:
+            sample_rate, bitrate, samples, frame_length, mpeg1, mono = frame
+            next_index = index + frame_length
+            # The next frame must follow if it is in the buffer
+            if next_index + 2 > len(data) or (
+                data[next_index] == 0xFF and data[next_index + 1] & 0xE0 == 0xE0
+            ):
+                frames = vbr_frames(data, index, mpeg1, mono)
+                if frames is not None:
+                    return frames * samples / sample_rate, None
+                audio_bytes = size - audio_start - index
+                return audio_bytes * 8 / bitrate, bitrate
+        index = data.find(b"\xff", index + 1)
+    return None
+
+
+def parse_frame_header(header):
+    if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 3
+    layer = 4 - ((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    mono = header[3] >> 6 == 3
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        frame_length = samples // 8 * bitrate // sample_rate + padding
+    return sample_rate, bitrate, samples, frame_length, mpeg1, mono
+
+
+# Frame count from a Xing/Info or VBRI header in the first frame
+def vbr_frames(data, index, mpeg1, mono):
+    if mpeg1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing = index + 4 + side_info
+    if data[xing : xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", data[xing + 4 : xing + 8])[0]
+        if flags & 1:
+            return struct.unpack(">I", data[xing + 8 : xing + 12])[0]
+        return None
+    vbri = index + 36
+    if data[vbri : vbri + 4] == b"VBRI":
+        return struct.unpack(">I", data[vbri + 14 : vbri + 18])[0]
+    return None
+
+
+def read_art(path, offset, length):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
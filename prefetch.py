@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+PREFETCH_COUNT = 3
+PREFETCH_WORKERS = 2
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+# Warms the songs that are about to play while the current one is playing:
+# the file data goes into the OS page cache, the library entry is refreshed
+# and the album art thumbnail is decoded. Switching to a warmed song then
+# needs no slow I/O on the UI thread.
+class Prefetcher:
+    def __init__(self, library, album_art_cache, workers=PREFETCH_WORKERS):
+        self.library = library
+        self.album_art_cache = album_art_cache
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.warmed = OrderedDict()
+
+    def prefetch(self, song_paths):
+        for song_path in song_paths:
+            with self.lock:
+                if song_path in self.pending or song_path in self.warmed:
+                    continue
+                self.pending.add(song_path)
+            self.pool.submit(self.warm, song_path)
+
+    def warm(self, song_path):
+        try:
+            track = self.library.lookup(song_path)
+            self.read_file(song_path)
+            if track.art_digest is not None and self.album_art_cache is not None:
+                self.album_art_cache.prefetch(
+                    track.art_digest,
+                    lambda: self.library.album_art_data(song_path),
+                )
+        except Exception as e:
+            print(f"Could not prefetch {song_path}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(song_path)
+                self.warmed[song_path] = True
+                while len(self.warmed) > PREFETCH_COUNT * 4:
+                    self.warmed.popitem(last=False)
+
+    # Reading the file once leaves it in the page cache for mixer.music.load
+    def read_file(self, song_path):
+        buffer = bytearray(READ_CHUNK_SIZE)
+        with open(song_path, "rb", buffering=0) as f:
+            while f.readinto(buffer):
+                pass
+
+    # Forget what was warmed, e.g. after the files changed on disk
+    def forget(self, song_path):
+        with self.lock:
+            self.warmed.pop(song_path, None)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+from collections import deque
+
+PROFILE_ENV = "MUSIC_PLAYER_PROFILE"
+PROFILE_DIR = "profiles"
+RECENT_SAMPLES = 256
+LAG_PROBE_INTERVAL = 250
+TRACEMALLOC_FRAMES = 10
+TRACEMALLOC_TOP = 50
+
+
+class Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def p95(self):
+        recent = sorted(self.recent)
+        return recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+
+
+class Measurement:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.record(self.name, time.perf_counter() - self.started)
+
+
+class NoMeasurement:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_MEASUREMENT = NoMeasurement()
+
+
+# Opt-in timings of the hot paths: button actions, song switches, mixer
+# loads, tag parsing, art decoding and how late Tk runs its callbacks.
+# Enabled by the MUSIC_PLAYER_PROFILE environment variable or the Debug
+# menu, and free apart from one attribute check while disabled. Timings may
+# be recorded from any thread.
+class Instrumentation:
+    def __init__(self):
+        self.enabled = bool(os.environ.get(PROFILE_ENV))
+        self.lock = threading.Lock()
+        self.timings = {}
+        # Callables returning a dict of counters, shown in the report
+        self.gauges = {}
+        self.root = None
+        self.lag_after_id = None
+        self.lag_expected = None
+        self.profile = None
+
+    def measure(self, name):
+        if not self.enabled:
+            return NO_MEASUREMENT
+        return Measurement(self, name)
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = Timing()
+            timing.add(seconds)
+
+    def add_gauge(self, name, read):
+        self.gauges[name] = read
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if enabled and self.root is not None:
+            self.probe_lag()
+
+    # Measure how late `root` runs an after() callback, a busy Tk thread
+    # shows up as lag
+    def watch_lag(self, root):
+        self.root = root
+        if self.enabled:
+            self.probe_lag()
+
+    def probe_lag(self):
+        if self.lag_after_id is not None:
+            return
+        self.lag_expected = time.perf_counter() + LAG_PROBE_INTERVAL / 1000
+        self.lag_after_id = self.root.after(LAG_PROBE_INTERVAL, self.lag_probed)
+
+    def lag_probed(self):
+        self.lag_after_id = None
+        if not self.enabled:
+            return
+        self.record("tk callback lag", max(0, time.perf_counter() - self.lag_expected))
+        self.probe_lag()
+
+    def report(self):
+        lines = ["Timings (count, mean, p95, max in ms):"]
+        with self.lock:
+            timings = sorted(self.timings.items())
+            for name, timing in timings:
+                lines.append(
+                    f"  {name:<28}{timing.count:7d}"
+                    f"{timing.total / timing.count * 1000:9.2f}"
+                    f"{timing.p95() * 1000:9.2f}{timing.max * 1000:9.2f}"
+                )
+        if not timings:
+            lines.append("  nothing recorded yet")
+        for name, read in self.gauges.items():
+            try:
+                values = read()
+            except Exception as e:
+                values = {"error": str(e)}
+            lines.append(f"{name}:")
+            for key, value in values.items():
+                lines.append(f"  {key:<28}{value}")
+        return "\n".join(lines)
+
+    def capturing(self):
+        return self.profile is not None
+
+    # cProfile only sees the thread that started it, the Tk thread here.
+    # tracemalloc sees the allocations of every thread.
+    def start_capture(self):
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    # Write the capture to `directory`, returns the paths of the files
+    def stop_capture(self, directory=PROFILE_DIR):
+        import tracemalloc
+
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        profile = self.profile
+        self.profile = None
+
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        profile_path = os.path.join(directory, f"profile-{stamp}.prof")
+        memory_path = os.path.join(directory, f"memory-{stamp}.txt")
+        report_path = os.path.join(directory, f"timings-{stamp}.txt")
+        profile.dump_stats(profile_path)
+        with open(memory_path, "w") as f:
+            for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                f.write(f"{stat}\n")
+        with open(report_path, "w") as f:
+            f.write(self.report() + "\n")
+        return [profile_path, memory_path, report_path]
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,103 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCAN_WORKERS = 16
+SCAN_BATCH_SIZE = 200
+
+
+# Walks folders recursively on a pool of worker threads. Every directory
+# listing and every batch of songs to read tags from is its own task, so on
+# network shares many listings and tag reads are in flight at once, also in
+# one flat folder. Found songs are pushed to `results` in batches.
+# Symlinks to directories are not followed, so a link loop is not walked.
+class FolderScanner:
+    def __init__(
+        self,
+        library,
+        workers=SCAN_WORKERS,
+        batch_size=SCAN_BATCH_SIZE,
+        content_digests=False,
+    ):
+        self.library = library
+        self.content_digests = content_digests
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.results = queue.Queue()
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.folders_scanned = 0
+        self.songs_found = 0
+        self.running = False
+
+    def scan(self, folder_path):
+        self.running = True
+        self.submit(self.scan_directory, folder_path.rstrip("/\\") or folder_path)
+
+    def submit(self, task, argument):
+        with self.lock:
+            self.pending += 1
+        try:
+            self.pool.submit(task, argument)
+        except RuntimeError:
+            # The pool was shut down by cancel()
+            self.finish_task()
+
+    def scan_directory(self, directory):
+        try:
+            if self.cancelled.is_set():
+                return
+            songs = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                self.submit(
+                                    self.scan_directory, directory + "/" + entry.name
+                                )
+                            elif entry.name.lower().endswith(".mp3"):
+                                songs.append(directory + "/" + entry.name)
+                        except OSError:
+                            continue
+            except OSError as e:
+                print(f"Could not scan {directory}: {e}")
+
+            for start in range(0, len(songs), self.batch_size):
+                self.submit(self.read_songs, songs[start : start + self.batch_size])
+        finally:
+            with self.lock:
+                self.folders_scanned += 1
+            self.finish_task()
+
+    def read_songs(self, batch):
+        try:
+            if self.cancelled.is_set():
+                return
+            self.library.lookup_many(batch)
+            if self.content_digests:
+                for song in batch:
+                    self.library.content_digest(song)
+            with self.lock:
+                self.songs_found += len(batch)
+            self.results.put(batch)
+        finally:
+            self.finish_task()
+
+    def finish_task(self):
+        with self.lock:
+            self.pending -= 1
+            done = self.pending == 0
+        if done:
+            self.running = False
+            self.results.put(None)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running = False
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
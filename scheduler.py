@@ -0,0 +1,59 @@
+TICK_INTERVAL = 100
+IDLE_TICK_INTERVAL = 1000
+
+
+# One window.after chain shared by everything that refreshes the UI over time.
+# Callbacks are registered once and run on every tick. The chain runs slower
+# while `is_idle()` is true or the window is minimized, and stops completely
+# when no callbacks are left.
+class TickScheduler:
+    def __init__(
+        self,
+        root,
+        interval=TICK_INTERVAL,
+        idle_interval=IDLE_TICK_INTERVAL,
+        is_idle=None,
+    ):
+        self.root = root
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.is_idle = is_idle
+        self.callbacks = []
+        self.after_id = None
+
+    def add(self, callback):
+        if callback not in self.callbacks:
+            self.callbacks.append(callback)
+        if self.after_id is None:
+            self.after_id = self.root.after(self.interval, self.tick)
+
+    def remove(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def tick(self):
+        self.after_id = None
+        for callback in list(self.callbacks):
+            try:
+                callback()
+            except Exception as e:
+                print("Error in scheduled callback:", str(e))
+        if self.callbacks:
+            self.after_id = self.root.after(self.next_interval(), self.tick)
+
+    def next_interval(self):
+        if self.is_idle is not None and self.is_idle():
+            return self.idle_interval
+        if self.root.state() == "iconic":
+            return self.idle_interval
+        return self.interval
+
+    # Number of registered callbacks and of pending after() chains (0 or 1)
+    def active_callbacks(self):
+        return len(self.callbacks), 0 if self.after_id is None else 1
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        self.callbacks = []
@@ -0,0 +1,79 @@
+import re
+from bisect import bisect_left
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+# Token index over the file names and the title, artist and album tags of
+# the songs in a TrackStore. A query matches the songs that have, for every
+# word of the query, a word starting with it. Words are kept sorted, so the
+# words sharing a prefix are found with two binary searches instead of
+# looking at every song.
+class SearchIndex:
+    def __init__(self):
+        self.tokens = {}
+        self.sorted_tokens = []
+        self.sorted = True
+        # Track ids below this one are indexed, ids are never reused
+        self.indexed = 0
+
+    def add(self, track_id, texts):
+        for text in texts:
+            if not text:
+                continue
+            for token in tokenize(text):
+                track_ids = self.tokens.get(token)
+                if track_ids is None:
+                    self.tokens[token] = [track_id]
+                    self.sorted = False
+                elif track_ids[-1] != track_id:
+                    track_ids.append(track_id)
+
+    # Index the songs added to the store since the last call, or up to
+    # `limit` of them. Their tags must already be in the library index.
+    # Returns whether every song is indexed.
+    def update(self, track_store, library, limit=None):
+        track_names = track_store.track_names
+        end = len(track_names)
+        if limit is not None:
+            end = min(end, self.indexed + limit)
+        for track_id in range(self.indexed, end):
+            song_name = track_names[track_id]
+            if song_name is None:
+                continue
+            track = library.get(track_store.path(track_id))
+            self.add(track_id, (song_name, track.title, track.artist, track.album))
+        self.indexed = end
+        return end == len(track_names)
+
+    def sort_tokens(self):
+        if not self.sorted:
+            self.sorted_tokens = sorted(self.tokens)
+            self.sorted = True
+
+    def prefix_matches(self, prefix):
+        self.sort_tokens()
+        first = bisect_left(self.sorted_tokens, prefix)
+        last = bisect_left(self.sorted_tokens, prefix + "\U0010ffff", first)
+        return set().union(
+            *(self.tokens[token] for token in self.sorted_tokens[first:last])
+        )
+
+    # Track ids matching the query, None for an empty query. Removed songs
+    # may still be part of the result.
+    def search(self, query):
+        words = tokenize(query)
+        if not words:
+            return None
+        # Longer words match fewer songs, start with them
+        words.sort(key=len, reverse=True)
+        result = self.prefix_matches(words[0])
+        for word in words[1:]:
+            if not result:
+                break
+            result &= self.prefix_matches(word)
+        return result
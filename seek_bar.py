@@ -0,0 +1,102 @@
+from tkinter import Canvas, HIDDEN, NORMAL
+
+WAVEFORM_COLOR = "#606060"
+PLAYED_COLOR = "#ffbf50"
+
+
+# Clickable progress bar showing the waveform of the current song. The
+# waveform is a single polygon whose points NumPy computes from the peaks,
+# and the played part is a second polygon over it that is only updated when
+# the progress moved by a pixel. Without peaks it is a plain bar.
+class SeekBar:
+    def __init__(self, master, on_seek, width=400, height=45, **options):
+        # Called with the clicked fraction of the song, 0 to 1
+        self.on_seek = on_seek
+        self.width = width
+        self.height = height
+        self.canvas = Canvas(
+            master, width=width, height=height, highlightthickness=0, **options
+        )
+        self.canvas.bind("<Button-1>", self.clicked)
+        # x and the top and bottom y of every peak, None for the plain bar
+        self.points = None
+        self.played_width = 0
+        self.show(None)
+
+    def place(self, **options):
+        self.canvas.place(**options)
+
+    # Show the waveform from peaks as computed by waveform.compute_peaks,
+    # None for the plain bar
+    def show(self, peaks):
+        self.canvas.delete("all")
+        self.points = None
+        middle = self.height / 2
+        if peaks is not None:
+            try:
+                import numpy
+            except ImportError:
+                peaks = None
+        if peaks is None:
+            self.waveform = self.canvas.create_rectangle(
+                0, middle - 2, self.width, middle + 2, fill=WAVEFORM_COLOR, width=0
+            )
+            self.played = self.canvas.create_rectangle(
+                0, middle - 2, 0, middle + 2, fill=PLAYED_COLOR, width=0, state=HIDDEN
+            )
+        else:
+            values = numpy.frombuffer(peaks, dtype=numpy.int8)
+            mins, maxs = values.reshape(2, -1).astype(float)
+            scale = (self.height / 2 - 1) / 128
+            # Silence still shows as a thin line
+            top = middle - numpy.maximum(maxs * scale, 0.5)
+            bottom = middle - numpy.minimum(mins * scale, -0.5)
+            x = numpy.linspace(0, self.width, len(mins))
+            self.points = (x, top, bottom)
+            self.waveform = self.canvas.create_polygon(
+                self.outline(len(x)), fill=WAVEFORM_COLOR
+            )
+            self.played = self.canvas.create_polygon(
+                0, 0, 0, 0, 0, 0, fill=PLAYED_COLOR, state=HIDDEN
+            )
+        self.played_width = 0
+
+    # Polygon points around the first `count` peaks, top edge left to right
+    # then bottom edge right to left
+    def outline(self, count):
+        import numpy
+
+        x, top, bottom = self.points
+        x = x[:count]
+        return numpy.concatenate(
+            (
+                numpy.column_stack((x, top[:count])).ravel(),
+                numpy.column_stack((x[::-1], bottom[count - 1 :: -1])).ravel(),
+            )
+        ).tolist()
+
+    def show_position(self, position, length):
+        if length <= 0:
+            played_width = 0
+        else:
+            played_width = int(min(max(position / length, 0), 1) * self.width)
+        if played_width == self.played_width:
+            return
+        self.played_width = played_width
+        if played_width == 0:
+            self.canvas.itemconfigure(self.played, state=HIDDEN)
+            return
+        if self.points is None:
+            middle = self.height / 2
+            self.canvas.coords(self.played, 0, middle - 2, played_width, middle + 2)
+        else:
+            x = self.points[0]
+            count = int(played_width / self.width * (len(x) - 1)) + 1
+            if count < 2:
+                self.canvas.itemconfigure(self.played, state=HIDDEN)
+                return
+            self.canvas.coords(self.played, self.outline(count))
+        self.canvas.itemconfigure(self.played, state=NORMAL)
+
+    def clicked(self, event):
+        self.on_seek(min(max(event.x / self.width, 0), 1))
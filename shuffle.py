@@ -0,0 +1,160 @@
+import random
+
+HISTORY_LIMIT = 10000
+
+
+# Shuffle play order kept next to the list instead of reordering it. The
+# permutation is drawn one song at a time with a sparse Fisher-Yates
+# shuffle, so turning shuffle on costs nothing and no song repeats until
+# every song was drawn. Songs are tracked by track id, which survives
+# deletes, and the songs played are kept in order so prev can walk back.
+class ShuffleOrder:
+    def __init__(self, track_store):
+        self.track_store = track_store
+        self.random = random.Random()
+        # Track ids played, and drawn to be played next after the cursor
+        self.history = []
+        self.cursor = -1
+        self.reset()
+
+    # Start a new permutation of `candidates`, a list of track ids, or of
+    # every song in the store for None. Songs drawn but not played yet are
+    # given back. The `playing` track id is left out of the permutation.
+    def reset(self, candidates=None, playing=None):
+        self.candidates = candidates
+        del self.history[self.cursor + 1 :]
+        self.restart()
+        if playing is not None:
+            self.take(playing)
+
+    # New permutation of the same candidates, the history is kept
+    def restart(self):
+        self.size = self.domain_size()
+        self.remaining = self.size
+        # Slot -> candidate index and back for slots moved by the shuffle,
+        # slots below `remaining` hold the candidates not drawn yet
+        self.swaps = {}
+        self.slots = {}
+
+    def at(self, slot):
+        return self.swaps.get(slot, slot)
+
+    def put(self, index, slot):
+        if index == slot:
+            self.swaps.pop(slot, None)
+            self.slots.pop(index, None)
+        else:
+            self.swaps[slot] = index
+            self.slots[index] = slot
+
+    # Remove the candidate in `slot` from the ones not drawn yet, the last
+    # of them fills its slot. Returns the candidate index.
+    def remove_slot(self, slot):
+        index = self.at(slot)
+        last = self.remaining - 1
+        self.put(self.at(last), slot)
+        self.swaps.pop(last, None)
+        self.slots.pop(index, None)
+        self.remaining -= 1
+        return index
+
+    # Remove a track id from the songs not drawn yet, if it is one of them
+    def take(self, track_id):
+        self.grow()
+        if self.candidates is None:
+            index = track_id if track_id < self.size else None
+        elif track_id in self.candidates:
+            index = self.candidates.index(track_id)
+        else:
+            index = None
+        if index is None:
+            return
+        slot = self.slots.get(index, index)
+        if slot < self.remaining and self.at(slot) == index:
+            self.remove_slot(slot)
+
+    def domain_size(self):
+        if self.candidates is None:
+            return len(self.track_store.track_names)
+        return len(self.candidates)
+
+    # Songs added to the store since the permutation started join the
+    # songs that were not drawn yet
+    def grow(self):
+        if self.candidates is not None:
+            return
+        size = self.domain_size()
+        for index in range(self.size, size):
+            self.put(index, self.remaining)
+            self.remaining += 1
+        self.size = size
+
+    def removed(self, track_id):
+        return self.track_store.track_names[track_id] is None
+
+    def draw(self):
+        self.grow()
+        while self.remaining:
+            index = self.remove_slot(self.random.randrange(self.remaining))
+            track_id = index if self.candidates is None else self.candidates[index]
+            if not self.removed(track_id):
+                return track_id
+        return None
+
+    # Track id of the song `ahead` songs after the current one, drawing new
+    # songs as needed. Every song was played once when the permutation runs
+    # out, then a new one starts after the songs already drawn.
+    def upcoming(self, ahead=1):
+        while True:
+            position = self.cursor + ahead
+            if position < len(self.history):
+                if not self.removed(self.history[position]):
+                    return self.history[position]
+                del self.history[position]
+                continue
+            track_id = self.draw()
+            if track_id is None:
+                self.restart()
+                track_id = self.draw()
+                if track_id is None:
+                    return None
+            self.history.append(track_id)
+
+    # Play these track ids right after the current song
+    def play_next(self, track_ids):
+        for track_id in track_ids:
+            self.take(track_id)
+        self.history[self.cursor + 1 : self.cursor + 1] = track_ids
+
+    # Track id of the song played before the current one
+    def previous(self):
+        while self.cursor > 0:
+            if not self.removed(self.history[self.cursor - 1]):
+                return self.history[self.cursor - 1]
+            del self.history[self.cursor - 1]
+            self.cursor -= 1
+        return None
+
+    # A song started: step to it when it is next to the current one in the
+    # history, otherwise it was picked by hand and goes in after the current
+    # and is not drawn again in this permutation
+    def started(self, track_id):
+        if self.cursor + 1 < len(self.history) and (
+            self.history[self.cursor + 1] == track_id
+        ):
+            self.cursor += 1
+        elif self.cursor > 0 and self.history[self.cursor - 1] == track_id:
+            self.cursor -= 1
+        elif self.cursor < 0 or self.history[self.cursor] != track_id:
+            self.take(track_id)
+            ahead = self.history[self.cursor + 1 :]
+            if track_id in ahead:
+                ahead.remove(track_id)
+                self.history[self.cursor + 1 :] = ahead
+            self.history.insert(self.cursor + 1, track_id)
+            self.cursor += 1
+
+        if len(self.history) > HISTORY_LIMIT:
+            dropped = len(self.history) - HISTORY_LIMIT
+            del self.history[:dropped]
+            self.cursor -= dropped
@@ -0,0 +1,187 @@
+from bisect import bisect_left, bisect_right
+from tkinter import Listbox, END
+
+
+# A Listbox that only holds the rows currently on screen. The songs stay in
+# the track store and every redraw reads just `height` names from it, so
+# adding, shuffling or deleting songs costs the same with 10 or 100k songs.
+# Positions passed in and out are positions in the whole list, like Listbox.
+# With a view set, only the songs at the view's positions are shown.
+class VirtualSongList:
+    def __init__(self, master, track_store, scrollbar, height=12, **options):
+        self.track_store = track_store
+        self.scrollbar = scrollbar
+        self.height = height
+        # Sorted positions of the songs shown, None to show every song
+        self.view = None
+        self.top = 0
+        self.selection = set()
+        self.active = None
+
+        self.listbox = Listbox(master, height=height, exportselection=False, **options)
+        self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.listbox.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.listbox.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll(3))
+        self.listbox.bind("<Up>", lambda event: self.move_active(-1))
+        self.listbox.bind("<Down>", lambda event: self.move_active(1))
+        self.listbox.bind("<Prior>", lambda event: self.move_active(-self.height))
+        self.listbox.bind("<Next>", lambda event: self.move_active(self.height))
+        self.scrollbar.configure(command=self.yview)
+
+    def pack(self, **options):
+        self.listbox.pack(**options)
+
+    def bind(self, sequence, func):
+        self.listbox.bind(sequence, func, add="+")
+
+    def size(self):
+        return len(self.track_store) if self.view is None else len(self.view)
+
+    # Position of the song shown in a row
+    def position(self, row):
+        return row if self.view is None else self.view[row]
+
+    # Row showing the song at a position, or the row it would be shown in
+    def row(self, position):
+        return position if self.view is None else bisect_left(self.view, position)
+
+    # Positions first..last that are shown
+    def shown(self, first, last):
+        if self.view is None:
+            return range(max(first, 0), min(last, len(self.track_store) - 1) + 1)
+        return self.view[bisect_left(self.view, first) : bisect_right(self.view, last)]
+
+    def set_view(self, view):
+        self.view = view
+        self.top = 0
+        self.refresh()
+
+    # Turn a Listbox style index ("end", "0", 3) into a position
+    def index(self, index):
+        if index == END:
+            return self.position(self.size() - 1) if self.size() else -1
+        return int(index)
+
+    def curselection(self):
+        return tuple(sorted(self.selection))
+
+    def select_set(self, first, last=None):
+        first = self.index(first)
+        last = first if last is None else self.index(last)
+        self.selection.update(self.shown(first, last))
+        self.refresh()
+
+    def select_clear(self, first, last=None):
+        first = self.index(first)
+        last = first if last is None else self.index(last)
+        self.selection = {
+            position for position in self.selection if not first <= position <= last
+        }
+        self.refresh()
+
+    def activate(self, index):
+        self.active = self.index(index)
+        self.refresh()
+
+    def see(self, index):
+        row = self.row(self.index(index))
+        if not self.top <= row < self.top + self.height:
+            self.top = row - self.height // 2
+            self.refresh()
+
+    # Songs were removed or moved in the track store. Shows `view` and
+    # selects the songs at `selection`, with a single redraw.
+    def update(self, view, selection=()):
+        self.view = view
+        self.selection = set(selection)
+        self.active = None
+        self.refresh()
+
+    def select_all(self):
+        self.selection = set(self.shown(0, len(self.track_store) - 1))
+        self.refresh()
+
+    # Select the row at `y` unless it is selected already, e.g. before a
+    # context menu opens
+    def select_at(self, y):
+        row = self.top + self.listbox.nearest(y)
+        if row < self.size():
+            position = self.position(row)
+            if position not in self.selection:
+                self.selection = {position}
+                self.active = position
+                self.refresh()
+
+    # Redraw the visible rows from the track store
+    def refresh(self):
+        count = self.size()
+        self.top = max(0, min(self.top, count - self.height))
+        bottom = min(count, self.top + self.height)
+
+        self.listbox.delete(0, END)
+        positions = [self.position(row) for row in range(self.top, bottom)]
+        names = [self.track_store.name_at(position) for position in positions]
+        if names:
+            self.listbox.insert(END, *names)
+        for row, position in enumerate(positions):
+            if position in self.selection:
+                self.listbox.selection_set(row)
+        if self.active is not None and self.active in positions:
+            self.listbox.activate(positions.index(self.active))
+
+        if count:
+            self.scrollbar.set(self.top / count, bottom / count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def yview(self, *args):
+        count = self.size()
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * count)
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self.height
+            self.top += amount
+        self.refresh()
+
+    def scroll(self, amount):
+        self.top += amount
+        self.refresh()
+        return "break"
+
+    def on_mouse_wheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+
+    def move_active(self, amount):
+        count = self.size()
+        if not count:
+            return "break"
+        row = self.row(self.active) if self.active is not None else self.top
+        row = max(0, min(row + amount, count - 1))
+        position = self.position(row)
+        self.selection = {position}
+        self.active = position
+        if row < self.top:
+            self.top = row
+        elif row >= self.top + self.height:
+            self.top = row - self.height + 1
+        self.refresh()
+        return "break"
+
+    # Keep the selection of the whole list in step with clicks on visible rows
+    def on_select(self, event):
+        visible = {
+            self.position(row)
+            for row in range(self.top, self.top + self.listbox.size())
+        }
+        self.selection = {
+            position for position in self.selection if position not in visible
+        }
+        if self.listbox.cget("selectmode") in ("browse", "single"):
+            self.selection = set()
+        for row in self.listbox.curselection():
+            self.selection.add(self.position(self.top + row))
+        if self.listbox.size():
+            self.active = self.position(self.top + self.listbox.index("active"))
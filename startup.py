@@ -0,0 +1,39 @@
+import os
+import time
+
+STARTUP_TIMING_ENV = "MUSIC_PLAYER_STARTUP_TIMING"
+
+
+# Records how long each phase of startup took. The report is printed when
+# the MUSIC_PLAYER_STARTUP_TIMING environment variable is set.
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+        self.background = []
+
+    # End the current phase on the main thread
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    # Record a phase that ran on another thread alongside the main one
+    def mark_background(self, phase, started, ended=None):
+        if ended is None:
+            ended = time.perf_counter()
+        self.background.append((phase, ended - started))
+
+    def report(self):
+        lines = ["Startup timing:"]
+        for phase, seconds in self.phases:
+            lines.append(f"  {phase:<24}{seconds * 1000:8.1f} ms")
+        lines.append(f"  {'total':<24}{(self.last - self.start) * 1000:8.1f} ms")
+        for phase, seconds in self.background:
+            lines.append(f"  {phase + ' (background)':<24}{seconds * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+    def print_report(self):
+        if os.environ.get(STARTUP_TIMING_ENV):
+            print(self.report())
@@ -0,0 +1,91 @@
+from shuffle import ShuffleOrder
+from track_store import TrackStore
+
+SONGS = 50
+
+
+def make_order(songs=SONGS, seed=0):
+    track_store = TrackStore()
+    for number in range(songs):
+        track_store.add(f"/music/song{number}.mp3")
+    order = ShuffleOrder(track_store)
+    order.random.seed(seed)
+    return order
+
+
+# Play `count` songs the way the engine does: look `ahead` songs ahead for
+# prefetching, then start the next one
+def play(order, count, ahead=1):
+    played = []
+    for _ in range(count):
+        for step in range(1, ahead + 1):
+            order.upcoming(step)
+        track_id = order.upcoming(1)
+        order.started(track_id)
+        played.append(track_id)
+    return played
+
+
+def test_every_song_plays_once_per_cycle():
+    order = make_order()
+    played = play(order, 3 * SONGS)
+    for cycle in range(3):
+        assert sorted(played[cycle * SONGS : (cycle + 1) * SONGS]) == list(range(SONGS))
+
+
+def test_looking_ahead_keeps_cycles_whole():
+    order = make_order()
+    played = play(order, 3 * SONGS, ahead=3)
+    for cycle in range(3):
+        assert sorted(played[cycle * SONGS : (cycle + 1) * SONGS]) == list(range(SONGS))
+
+
+def test_hand_picked_song_is_not_drawn_again():
+    order = make_order()
+    order.started(7)
+    played = [7] + play(order, SONGS - 1, ahead=3)
+    assert sorted(played) == list(range(SONGS))
+
+
+def test_hand_picked_song_drawn_ahead_plays_once():
+    order = make_order()
+    played = play(order, 10, ahead=3)
+    picked = order.upcoming(2)
+    order.started(picked)
+    played.append(picked)
+    played += play(order, SONGS - 11, ahead=3)
+    assert sorted(played) == list(range(SONGS))
+
+
+def test_playing_song_is_left_out_of_new_permutation():
+    order = make_order()
+    order.reset(playing=3)
+    order.started(3)
+    played = [3] + play(order, SONGS - 1)
+    assert sorted(played) == list(range(SONGS))
+
+
+def test_play_next_songs_are_not_drawn_again():
+    order = make_order()
+    played = play(order, 5)
+    order.play_next([40, 41])
+    played += play(order, SONGS - 5, ahead=3)
+    assert sorted(played) == list(range(SONGS))
+
+
+def test_songs_added_during_a_cycle_join_it():
+    order = make_order()
+    played = play(order, 10, ahead=3)
+    for number in range(SONGS, SONGS + 5):
+        order.track_store.add(f"/music/song{number}.mp3")
+    played += play(order, SONGS - 5, ahead=3)
+    assert sorted(played) == list(range(SONGS + 5))
+
+
+def test_previous_walks_back_the_played_songs():
+    order = make_order()
+    played = play(order, 5)
+    assert order.previous() == played[3]
+    order.started(played[3])
+    assert order.previous() == played[2]
+    assert order.upcoming(1) == played[4]
@@ -0,0 +1,53 @@
+import io
+import os
+
+from profiler import instrumentation
+
+THUMBNAIL_DIR = "thumbnails"
+
+
+# Resized album art on disk, named after the hash of the embedded image bytes.
+# Every song of an album usually embeds the same cover, so each cover is
+# decoded and resized once per display size and shared by all of them.
+class ThumbnailStore:
+    def __init__(self, directory=THUMBNAIL_DIR):
+        self.directory = directory
+
+    def path(self, digest, size):
+        return os.path.join(
+            self.directory, digest[:2], f"{digest}_{size[0]}x{size[1]}.png"
+        )
+
+    # Return the thumbnail as a PIL image. `load_data` is only called to get
+    # the embedded image bytes when the thumbnail is not on disk yet.
+    def thumbnail(self, digest, size, load_data):
+        try:
+            from PIL import Image
+        except ImportError:
+            print("Pillow not found. Please install Pillow.")
+            return None
+
+        path = self.path(digest, size)
+        try:
+            img = Image.open(path)
+            img.load()
+            return img
+        except (OSError, ValueError):
+            pass
+
+        img_data = load_data()
+        if img_data is None:
+            return None
+        with instrumentation.measure("art decode"):
+            # Any format Pillow can read works here, not just JPEG
+            img = Image.open(io.BytesIO(img_data))
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            img = img.resize(size, Image.LANCZOS)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary name first so readers never see half a file
+            img.save(path + ".tmp", "PNG")
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save thumbnail {path}: {e}")
+        return img
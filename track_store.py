@@ -0,0 +1,207 @@
+import os
+import sys
+from array import array
+from bisect import bisect_right
+
+
+# Holds the song list as parallel arrays indexed by an integer track id.
+# Directory strings are stored once and shared by every song in them, and
+# the play order is a separate array of track ids, so reordering never
+# touches the track data itself.
+class TrackStore:
+    def __init__(self, key=None):
+        self.key = key
+        self.directories = []
+        self.directory_ids = {}
+        self.track_directories = array("I")
+        self.track_names = []
+        self.order = array("I")
+        self.keys = {}
+        # Path -> track id, the key index itself when songs are keyed by path
+        self.track_ids = self.keys if key is None else {}
+        # Key of every track id when songs are not keyed by path
+        self.track_keys = {}
+        # Position of every track id in the order, built when first needed
+        self.position_index = None
+
+    def __len__(self):
+        return len(self.order)
+
+    # Add a song to the end of the list, returns None if it is already listed
+    def add(self, path):
+        key = self.key_for(path)
+        if key in self.keys:
+            return None
+
+        song_name = os.path.basename(path)
+        directory_id = self.directory_id(path[: len(path) - len(song_name)])
+
+        track_id = len(self.track_names)
+        self.track_directories.append(directory_id)
+        self.track_names.append(song_name)
+        self.order.append(track_id)
+        self.keys[key] = track_id
+        if self.key is not None:
+            self.track_ids[path] = track_id
+            self.track_keys[track_id] = key
+        if self.position_index is not None:
+            self.position_index.append(len(self.order) - 1)
+        return track_id
+
+    # Track id of a listed song by path, None if it is not listed
+    def find(self, path):
+        return self.track_ids.get(path)
+
+    # The file of a song was renamed or moved, it keeps its place in the
+    # list. Its content did not change, so only a path key changes.
+    def rename(self, track_id, path):
+        old_path = self.path(track_id)
+        if self.track_ids.get(old_path) == track_id:
+            del self.track_ids[old_path]
+        song_name = os.path.basename(path)
+        directory_id = self.directory_id(path[: len(path) - len(song_name)])
+        self.track_directories[track_id] = directory_id
+        self.track_names[track_id] = song_name
+        self.track_ids[path] = track_id
+
+    def directory_id(self, directory):
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = len(self.directories)
+            self.directories.append(sys.intern(directory))
+            self.directory_ids[directory] = directory_id
+        return directory_id
+
+    def key_for(self, path):
+        if self.key is None:
+            return path
+        return self.key(path)
+
+    # Change how duplicates are detected and rebuild the key index
+    def set_key(self, key):
+        self.key = key
+        self.keys = {}
+        self.track_ids = self.keys if key is None else {}
+        self.track_keys = {}
+        for track_id in self.order:
+            path = self.path(track_id)
+            track_key = self.key_for(path)
+            self.keys.setdefault(track_key, track_id)
+            if key is not None:
+                self.track_ids[path] = track_id
+                self.track_keys[track_id] = track_key
+
+    def track_id(self, position):
+        return self.order[position]
+
+    def path(self, track_id):
+        return (
+            self.directories[self.track_directories[track_id]]
+            + self.track_names[track_id]
+        )
+
+    def name(self, track_id):
+        return self.track_names[track_id]
+
+    def path_at(self, position):
+        return self.path(self.order[position])
+
+    def name_at(self, position):
+        return self.track_names[self.order[position]]
+
+    def paths(self):
+        for track_id in self.order:
+            yield self.path(track_id)
+
+    # Remove the songs at the given positions in one pass over the order,
+    # returns their track ids
+    def remove_many(self, positions):
+        removing = set(positions)
+        removed = [self.order[position] for position in sorted(removing)]
+        self.order = array(
+            "I",
+            (
+                track_id
+                for position, track_id in enumerate(self.order)
+                if position not in removing
+            ),
+        )
+        self.position_index = None
+        for track_id in removed:
+            path = self.path(track_id)
+            if self.key is None:
+                key = path
+            else:
+                key = self.track_keys.pop(track_id)
+                if self.track_ids.get(path) == track_id:
+                    del self.track_ids[path]
+            if self.keys.get(key) == track_id:
+                del self.keys[key]
+            # The id is never reused, only the name is released
+            self.track_names[track_id] = None
+        return removed
+
+    # Move the songs at the given positions, in list order, in front of the
+    # song at `target`. Returns the new positions of the moved songs.
+    def move(self, positions, target):
+        moving = set(positions)
+        picked = array("I", (self.order[position] for position in sorted(moving)))
+        rest = array(
+            "I",
+            (
+                track_id
+                for position, track_id in enumerate(self.order)
+                if position not in moving
+            ),
+        )
+        target -= sum(1 for position in moving if position < target)
+        self.order = rest[:target] + picked + rest[target:]
+        self.position_index = None
+        return range(target, target + len(picked))
+
+    # Position of every track id, -1 for removed tracks
+    def positions(self):
+        if self.position_index is None:
+            self.position_index = array("i", [-1]) * len(self.track_names)
+            for position, track_id in enumerate(self.order):
+                self.position_index[track_id] = position
+        return self.position_index
+
+    # Position of a track id, None if it was removed
+    def position_of(self, track_id):
+        position = self.positions()[track_id]
+        return None if position < 0 else position
+
+    # Sorted positions of the given track ids, removed tracks are skipped
+    def positions_of(self, track_ids):
+        position_index = self.positions()
+        positions = [position_index[track_id] for track_id in track_ids]
+        positions.sort()
+        if positions and positions[0] < 0:
+            positions = positions[bisect_right(positions, -1) :]
+        return positions
+
+    def clear(self):
+        self.__init__(self.key)
+
+    # Bytes used by the store, per part and in total
+    def memory_usage(self):
+        usage = {
+            "order": sys.getsizeof(self.order),
+            "directories": sys.getsizeof(self.track_directories)
+            + sys.getsizeof(self.directories)
+            + sys.getsizeof(self.directory_ids)
+            + sum(sys.getsizeof(directory) for directory in self.directories),
+            "names": sys.getsizeof(self.track_names)
+            + sum(sys.getsizeof(name) for name in self.track_names if name),
+            "keys": sys.getsizeof(self.keys)
+            + sum(sys.getsizeof(key) for key in self.keys)
+            + (
+                sys.getsizeof(self.track_ids) + sys.getsizeof(self.track_keys)
+                if self.track_ids is not self.keys
+                else 0
+            ),
+            "positions": sys.getsizeof(self.position_index or ()),
+        }
+        usage["total"] = sum(usage.values())
+        return usage
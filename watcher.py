@@ -0,0 +1,433 @@
+import os
+import sys
+import errno
+import queue
+import select
+import struct
+import threading
+
+POLL_INTERVAL = 1.0
+EVENT_BUFFER = 64 * 1024
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_song(name):
+    return name.lower().endswith(".mp3")
+
+
+# The Linux inotify API through ctypes
+class Inotify:
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self.error()
+
+    def error(self, path=None):
+        errno = self.ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+
+    def add_watch(self, path):
+        watch_id = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if watch_id < 0:
+            self.error(path)
+        return watch_id
+
+    def remove_watch(self, watch_id):
+        self.libc.inotify_rm_watch(self.fd, watch_id)
+
+    # Every event queued so far as (watch id, mask, cookie, name)
+    def read(self):
+        while True:
+            try:
+                data = os.read(self.fd, EVENT_BUFFER)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                watch_id, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                yield watch_id, mask, cookie, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+# What changed on disk since the last batch
+class LibraryChanges:
+    def __init__(self):
+        # (old path, new path) of songs that were renamed or moved
+        self.moved = []
+        # Path -> whether the song is there now, only the last change counts
+        self.exists = {}
+        # (folder, paths of every song in it) for folders listed from scratch
+        self.synced = []
+
+    def __bool__(self):
+        return bool(self.moved or self.exists or self.synced)
+
+
+# Watches library folders and their subfolders for songs that are added,
+# removed or renamed. On Linux inotify reports changes as they happen,
+# elsewhere, or when inotify is out of watches, every known directory's
+# mtime is checked once a second and only changed directories are listed
+# again. Either way the thread keeps what it last saw of every directory and
+# pushes the differences to `changes` as LibraryChanges, with the tags of
+# new songs already in the library index.
+class FolderWatcher:
+    def __init__(
+        self,
+        library,
+        poll_interval=POLL_INTERVAL,
+        use_inotify=True,
+        content_digests=False,
+    ):
+        self.library = library
+        # Hash new songs whole too, for content duplicate detection
+        self.content_digests = content_digests
+        self.poll_interval = poll_interval
+        self.changes = queue.Queue()
+        self.requests = queue.Queue()
+        self.folders = []
+        # Folders that could not be read, e.g. unmounted shares, and whether
+        # to reconcile them once they can be read again
+        self.unreadable = {}
+        # Directory -> [mtime, song names, subdirectory names] as last seen
+        self.directories = {}
+        self.watches = {}
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+        self.inotify = None
+        self.wake_read = self.wake_write = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+                self.wake_read, self.wake_write = os.pipe()
+            except (OSError, AttributeError) as e:
+                print("inotify unavailable, polling folders instead:", str(e))
+                self.inotify = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Start watching a folder. With reconcile=True the songs in it are
+    # reported in `synced`, e.g. to catch up with changes made while the
+    # player was closed.
+    def watch(self, folder, reconcile=False):
+        self.requests.put((folder.rstrip("/\\") or folder, reconcile))
+        self.wake()
+
+    def wake(self):
+        self.wakeup.set()
+        if self.wake_write is not None:
+            os.write(self.wake_write, b"\0")
+
+    def stop(self):
+        self.stopped.set()
+        self.wake()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.publish(self.add_folders())
+            changes = LibraryChanges()
+            if self.inotify is not None:
+                # Unreadable folders are tried again every poll interval
+                timeout = self.poll_interval if self.unreadable else None
+                ready = select.select(
+                    [self.inotify.fd, self.wake_read], [], [], timeout
+                )[0]
+                if self.wake_read in ready:
+                    os.read(self.wake_read, 1024)
+                if self.inotify is not None and self.inotify.fd in ready:
+                    self.read_events(changes)
+            else:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                self.poll(changes)
+            self.retry_folders(changes)
+            self.publish(changes)
+        if self.inotify is not None:
+            self.inotify.close()
+
+    def add_folders(self):
+        changes = LibraryChanges()
+        while True:
+            try:
+                folder, reconcile = self.requests.get_nowait()
+            except queue.Empty:
+                return changes
+            if folder in self.folders:
+                continue
+            self.folders.append(folder)
+            self.open_folder(folder, reconcile, changes)
+
+    # Walk a watched folder. A folder that can not be read is not empty, it
+    # is tried again later and none of its songs are reported as removed.
+    def open_folder(self, folder, reconcile, changes):
+        songs = self.walk(folder)
+        if songs is None:
+            self.unreadable[folder] = reconcile
+        elif reconcile:
+            changes.synced.append((folder, set(songs)))
+
+    def retry_folders(self, changes):
+        for folder, reconcile in list(self.unreadable.items()):
+            if os.path.isdir(folder):
+                del self.unreadable[folder]
+                self.open_folder(folder, reconcile, changes)
+
+    # A watched folder can not be read any more. What was seen in it is
+    # dropped without reporting removals, once it is back it is compared
+    # with the song list.
+    def suspend(self, folder):
+        prefix = folder + "/"
+        for directory in list(self.directories):
+            if directory == folder or directory.startswith(prefix):
+                del self.directories[directory]
+        for watch_id, directory in list(self.watches.items()):
+            if directory == folder or directory.startswith(prefix):
+                del self.watches[watch_id]
+                if self.inotify is not None:
+                    self.inotify.remove_watch(watch_id)
+        self.unreadable[folder] = True
+
+    def publish(self, changes):
+        if not changes:
+            return
+        added = [path for path, exists in changes.exists.items() if exists]
+        for folder, songs in changes.synced:
+            added.extend(songs)
+        self.library.lookup_many(added)
+        if self.content_digests:
+            for path in added:
+                self.library.content_digest(path)
+        self.changes.put(changes)
+
+    # Record a new directory and everything below it, returns the paths of
+    # the songs found, or None if the directory itself can not be listed.
+    # The songs are marked as added in `changes` if given.
+    def walk(self, directory, changes=None):
+        top = directory
+        songs = []
+        directories = [directory]
+        while directories:
+            directory = directories.pop()
+            # Watched before it is listed, so nothing created in between is missed
+            self.add_watch(directory)
+            state = self.list_directory(directory)
+            if state is None:
+                if directory == top:
+                    return None
+                continue
+            self.directories[directory] = state
+            for name in state[1]:
+                songs.append(directory + "/" + name)
+            for name in state[2]:
+                directories.append(directory + "/" + name)
+        if changes is not None:
+            for song in songs:
+                changes.exists[song] = True
+        return songs
+
+    # [mtime, song names, subdirectory names] of a directory, None if it
+    # can not be listed. Symlinks to directories are not followed, so a link
+    # loop is not walked.
+    def list_directory(self, directory):
+        songs = set()
+        subdirectories = set()
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.add(entry.name)
+                        elif is_song(entry.name):
+                            songs.add(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return [mtime, songs, subdirectories]
+
+    def add_watch(self, directory):
+        if self.inotify is None:
+            return
+        try:
+            self.watches[self.inotify.add_watch(directory)] = directory
+        except OSError as e:
+            if e.errno in (errno.ENOSPC, errno.EMFILE):
+                # Out of inotify watches or instances, poll every directory
+                print("Could not watch folders with inotify, polling instead:", str(e))
+                self.inotify.close()
+                self.inotify = None
+                self.watches.clear()
+            elif e.errno != errno.ENOENT:
+                # Only this directory goes unwatched, a vanished one is
+                # noticed by its parent
+                print(f"Could not watch {directory}: {e}")
+
+    # A directory and everything below it is gone
+    def forget(self, directory, changes):
+        directories = [directory]
+        while directories:
+            directory = directories.pop()
+            state = self.directories.pop(directory, None)
+            if state is None:
+                continue
+            for name in state[1]:
+                changes.exists[directory + "/" + name] = False
+            for name in state[2]:
+                directories.append(directory + "/" + name)
+
+    # List a directory again and record the differences
+    def rescan(self, directory, changes):
+        old_state = self.directories[directory]
+        state = self.list_directory(directory)
+        if state is None:
+            # A directory that was deleted is forgotten when its parent is
+            # listed again, a folder that can not be read is suspended
+            if directory in self.folders:
+                self.suspend(directory)
+            return
+        self.directories[directory] = state
+        for name in state[1] - old_state[1]:
+            changes.exists[directory + "/" + name] = True
+        for name in old_state[1] - state[1]:
+            changes.exists[directory + "/" + name] = False
+        for name in state[2] - old_state[2]:
+            self.walk(directory + "/" + name, changes)
+        for name in old_state[2] - state[2]:
+            self.forget(directory + "/" + name, changes)
+
+    # Only the mtime of every directory is read, adding, removing or
+    # renaming an entry changes the mtime of its directory
+    def poll(self, changes):
+        for directory, state in list(self.directories.items()):
+            if directory not in self.directories:
+                # Forgotten with its parent in this round
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                # Deleted directories are forgotten through their parent, a
+                # short network error must not empty a whole folder
+                if directory in self.folders:
+                    self.suspend(directory)
+                continue
+            if mtime != state[0]:
+                self.rescan(directory, changes)
+
+    # A directory was renamed or moved within the watched folders. Its
+    # watches follow it, only the recorded paths change.
+    def move_directory(self, old, new, changes):
+        prefix = old + "/"
+        for directory in list(self.directories):
+            if directory != old and not directory.startswith(prefix):
+                continue
+            new_directory = new + directory[len(old) :]
+            state = self.directories.pop(directory)
+            self.directories[new_directory] = state
+            for name in state[1]:
+                old_path = directory + "/" + name
+                new_path = new_directory + "/" + name
+                changes.moved.append((old_path, new_path))
+                changes.exists[old_path] = False
+                changes.exists[new_path] = True
+        for watch_id, directory in self.watches.items():
+            if directory == old or directory.startswith(prefix):
+                self.watches[watch_id] = new + directory[len(old) :]
+
+    def read_events(self, changes):
+        # Cookie -> (path, is a directory) of moves that have not arrived yet
+        moved_from = {}
+        for watch_id, mask, cookie, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, compare every directory with the disk
+                for directory in list(self.directories):
+                    if directory in self.directories:
+                        self.rescan(directory, changes)
+                continue
+            if mask & IN_IGNORED:
+                # The watch is gone, a watched folder may have been unmounted
+                directory = self.watches.pop(watch_id, None)
+                if directory in self.folders:
+                    self.suspend(directory)
+                continue
+            directory = self.watches.get(watch_id)
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # Other directories are followed through their parent
+                if directory in self.folders:
+                    self.suspend(directory)
+                continue
+            state = self.directories.get(directory)
+            if state is None:
+                continue
+            path = directory + "/" + name
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    state[2].add(name)
+                    old = moved_from.pop(cookie, None) if mask & IN_MOVED_TO else None
+                    if old is not None and old[0] in self.directories:
+                        self.move_directory(old[0], path, changes)
+                    else:
+                        self.walk(path, changes)
+                elif mask & IN_MOVED_FROM:
+                    state[2].discard(name)
+                    moved_from[cookie] = (path, True)
+                elif mask & IN_DELETE:
+                    state[2].discard(name)
+                    self.forget(path, changes)
+            elif is_song(name):
+                # Songs count once they were written completely
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    state[1].add(name)
+                    old = moved_from.pop(cookie, None) if mask & IN_MOVED_TO else None
+                    if old is not None:
+                        changes.moved.append((old[0], path))
+                        changes.exists[old[0]] = False
+                    changes.exists[path] = True
+                elif mask & IN_MOVED_FROM:
+                    state[1].discard(name)
+                    moved_from[cookie] = (path, False)
+                elif mask & IN_DELETE:
+                    state[1].discard(name)
+                    changes.exists[path] = False
+
+        # Moved out of the watched folders
+        for path, is_directory in moved_from.values():
+            if is_directory:
+                self.forget(path, changes)
+            else:
+                changes.exists[path] = False
@@ -0,0 +1,130 @@
+import os
+import queue
+
+WAVEFORM_BINS = 400
+WAVEFORM_WORKERS = 2
+DRAIN_INTERVAL = 50
+
+
+# Runs in the worker processes, which decode songs but never play them
+def init_worker():
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+
+
+# Process pool for decoding songs, multiprocessing is only imported once a
+# pool is needed. Forking a process that runs Tk and the mixer is not safe,
+# so workers are spawned.
+def start_pool(workers, initializer=init_worker):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+    )
+
+
+# Decode a whole song in a worker, returns an array of (frames, channels)
+# samples and the sample rate
+def decode(path):
+    import pygame
+
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    samples = pygame.sndarray.array(pygame.mixer.Sound(path))
+    if samples.ndim == 1:
+        samples = samples.reshape(-1, 1)
+    return samples, pygame.mixer.get_init()[0]
+
+
+# Decode a song and reduce it to `bins` (min, max) pairs. Returns the bins
+# mins followed by the bins maxes as signed bytes, or None for no audio.
+def compute_peaks(path, bins):
+    import numpy
+
+    samples, sample_rate = decode(path)
+    frames = len(samples)
+    if frames == 0:
+        return None
+    channels = samples.shape[1]
+    # Samples of all channels are interleaved, every bin covers whole frames
+    flat = samples.reshape(-1)
+    starts = numpy.arange(bins) * frames // bins * channels
+    mins = numpy.minimum.reduceat(flat, starts)
+    maxs = numpy.maximum.reduceat(flat, starts)
+    if flat.dtype.itemsize > 1:
+        shift = flat.dtype.itemsize * 8 - 8
+        mins = mins >> shift
+        maxs = maxs >> shift
+    return mins.astype(numpy.int8).tobytes() + maxs.astype(numpy.int8).tobytes()
+
+
+# Min/max peaks of songs for the seek bar. Peaks are computed in a pool of
+# worker processes, so decoding a whole song never competes with the UI
+# thread for the GIL, and stored in the library index keyed by the file's
+# size and modification time. Results come back to the UI thread through a
+# queue drained with window.after.
+class WaveformLoader:
+    def __init__(self, root, library, bins=WAVEFORM_BINS):
+        self.root = root
+        self.library = library
+        self.bins = bins
+        self.pool = None
+        self.available = True
+        self.results = queue.Queue()
+        # Path -> callbacks waiting for peaks being computed
+        self.pending = {}
+        self.after_id = None
+
+    # `on_loaded(track, peaks)` runs on the UI thread, right away when the
+    # peaks are in the library index. Nothing is called when the peaks can
+    # not be computed.
+    def load(self, track, on_loaded):
+        peaks = self.library.waveform(track)
+        if peaks is not None:
+            on_loaded(track, peaks)
+            return
+        if not self.available:
+            return
+        if track.path in self.pending:
+            self.pending[track.path].append(on_loaded)
+            return
+
+        if self.pool is None:
+            self.pool = start_pool(WAVEFORM_WORKERS)
+        self.pending[track.path] = [on_loaded]
+        future = self.pool.submit(compute_peaks, track.path, self.bins)
+        future.add_done_callback(lambda future: self.results.put((track, future)))
+        if self.after_id is None:
+            self.after_id = self.root.after(DRAIN_INTERVAL, self.drain)
+
+    def drain(self):
+        self.after_id = None
+        while True:
+            try:
+                track, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            callbacks = self.pending.pop(track.path, [])
+            try:
+                peaks = future.result()
+            except ImportError:
+                print("NumPy not found. Please install NumPy.")
+                self.available = False
+                continue
+            except Exception as e:
+                print(f"Could not compute the waveform of {track.path}: {e}")
+                continue
+            if peaks is None:
+                continue
+            self.library.save_waveform(track, peaks)
+            for on_loaded in callbacks:
+                on_loaded(track, peaks)
+        if self.pending:
+            self.after_id = self.root.after(DRAIN_INTERVAL, self.drain)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)